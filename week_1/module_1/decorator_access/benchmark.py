@@ -0,0 +1,47 @@
+import timeit
+
+from main import access_control, get_user_role
+
+
+def add(a: int, b: int) -> int:
+    return a + b
+
+
+def list_access_control(roles):
+    # Previous implementation: role lookup through a function and a linear scan of the list
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            role = get_user_role()
+            if role in roles:
+                return func(*args, **kwargs)
+            else:
+                raise PermissionError("User has no access to this function")
+
+        return wrapper
+
+    return decorator
+
+
+def run_overhead(func, number: int = 500_000) -> float:
+    """
+    Measure time of a single call
+    :param func: function to call
+    :param number: amount of calls
+    :return: nanoseconds per call
+    """
+    timer = timeit.Timer("f(1, 2)", globals={"f": func})
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e9
+
+
+if __name__ == "__main__":
+    roles = ["guest", "viewer", "user", "editor", "admin", "moderator"]
+    implementations = {
+        "undecorated": add,
+        "list scan": list_access_control(roles)(add),
+        "bitmask policy": access_control(roles)(add),
+    }
+
+    baseline = run_overhead(add)
+    for name, func in implementations.items():
+        result = run_overhead(func)
+        print(f"{name:>16}: {result:6.1f} ns/call, overhead {result - baseline:6.1f} ns")
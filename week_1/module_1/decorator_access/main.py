@@ -1,17 +1,383 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import fnmatch
+import functools
+import inspect
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
+from concurrent.futures import ThreadPoolExecutor
 
 CURRENT_USER_ROLE = "moderator"
+# Roles inherit access of the roles listed for them
+ROLE_HIERARCHY = {
+    "admin": ["moderator"],
+    "moderator": ["user"],
+}
+
+# Attempts to write an audit batch before it is counted as failed and dropped
+AUDIT_WRITE_ATTEMPTS = 3
+# Seconds before the second attempt to write an audit batch, doubled after every failed attempt
+AUDIT_RETRY_DELAY = 0.1
+
+# Role of the current principal, separate for every thread and asyncio task
+_current_role = contextvars.ContextVar("current_role")
 
 
 def get_user_role():
-    return CURRENT_USER_ROLE
+    return _current_role.get(CURRENT_USER_ROLE)
+
+
+def set_user_role(role: str) -> contextvars.Token:
+    """
+    Set role of the current principal in the current context
+    :param role: role name
+    :return: token to restore the previous role with _current_role.reset
+    """
+    return _current_role.set(role)
+
+
+@contextlib.contextmanager
+def user_role(role: str):
+    """
+    Act as a principal with the given role inside the with block
+    :param role: role name
+    """
+    token = _current_role.set(role)
+    try:
+        yield
+    finally:
+        _current_role.reset(token)
+
+
+class AccessPolicy(object):
+    """
+    Compiles allowed role patterns to bitmasks at decoration time. Every pattern gets a bit,
+    a role's mask has bits of all patterns matching the role or any role it inherits
+    """
+
+    def __init__(self, hierarchy: dict[str, list[str]] = None):
+        self.lock = threading.Lock()
+        self.parents = {role: set(inherits) for role, inherits in (hierarchy or {}).items()}
+        self.bits = {}
+        # Compiled role masks, read without locking on every call and rebuilt lazily after changes
+        self.masks = {}
+
+    def add_role(self, role: str, inherits: list[str] = ()) -> None:
+        """
+        Register role and roles it inherits access of
+        :param role: role name
+        :param inherits: list of role names
+        :return: None
+        """
+        with self.lock:
+            self.parents.setdefault(role, set()).update(inherits)
+            self.masks.clear()
+
+    def compile(self, roles: list[str]) -> int:
+        """
+        Compile allowed roles into a bitmask
+        :param roles: list of role names or fnmatch-style patterns, e.g. "*" or "support:*"
+        :return: required mask, call is allowed if it shares a bit with principal's mask
+        """
+        required = 0
+        with self.lock:
+            for pattern in roles:
+                if pattern not in self.bits:
+                    self.bits[pattern] = 1 << len(self.bits)
+                    self.masks.clear()
+                required |= self.bits[pattern]
+        return required
+
+    def mask_for(self, role: str) -> int:
+        """
+        Compute and cache the mask of a role
+        :param role: role name
+        :return: mask
+        """
+        with self.lock:
+            roles = {role}
+            stack = [role]
+            while stack:
+                for parent in self.parents.get(stack.pop(), ()):
+                    if parent not in roles:
+                        roles.add(parent)
+                        stack.append(parent)
+
+            mask = 0
+            for pattern, bit in self.bits.items():
+                if any(fnmatch.fnmatchcase(name, pattern) for name in roles):
+                    mask |= bit
+            self.masks[role] = mask
+
+        return mask
+
+
+DEFAULT_POLICY = AccessPolicy(ROLE_HIERARCHY)
+
+
+class JsonlAuditWriter(object):
+    """
+    Appends audit records to a JSON lines file
+    """
+
+    def __init__(self, fp: str):
+        self.file = open(fp, "a")
+
+    def write_batch(self, records: list[tuple]) -> None:
+        self.file.writelines(
+            json.dumps({"ts": ts, "function": name, "role": role, "allowed": allowed}) + "\n"
+            for ts, name, role, allowed in records
+        )
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SqliteAuditWriter(object):
+    """
+    Inserts audit records into an sqlite table, one transaction per batch
+    """
+
+    def __init__(self, fp: str, table: str = "audit"):
+        # Connection is used by the flushing thread only, but created and closed by the owner
+        self.connection = sqlite3.connect(fp, check_same_thread=False)
+        self.table = table
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (ts REAL, function TEXT, role TEXT, allowed INTEGER)"
+        )
+        self.connection.commit()
+
+    def write_batch(self, records: list[tuple]) -> None:
+        with self.connection:
+            self.connection.executemany(f"INSERT INTO {self.table} VALUES (?, ?, ?, ?)", records)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class AuditSink(object):
+    """
+    Collects access decisions without blocking callers: records are appended to a bounded buffer
+    and written by a background thread in batches
+    """
+
+    def __init__(
+            self,
+            writer,
+            capacity: int = 65536,
+            batch_size: int = 1024,
+            flush_interval: float = 1.,
+            block: bool = False,
+    ):
+        """
+        :param writer: object with write_batch and close methods, e.g. JsonlAuditWriter or SqliteAuditWriter
+        :param capacity: max amount of records waiting to be written
+        :param batch_size: max amount of records written at once, reaching it wakes the flushing thread up
+        :param flush_interval: max seconds between flushes
+        :param block: whether callers wait for free space when buffer is full, otherwise records are dropped
+        """
+        self.writer = writer
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+        # deque appends and pops are atomic, so producers never take a lock while there is free space
+        self.buffer = collections.deque()
+        self.wakeup = threading.Event()
+        self.space = threading.Condition()
+        self.stats_lock = threading.Lock()
+        self.decisions = collections.defaultdict(lambda: [0, 0])
+        self.dropped = 0
+        self.written = 0
+        # Records of batches the writer failed to write after all attempts
+        self.failed = 0
+        self.last_error = None
+        self.started_at = time.monotonic()
+        self.thread = None
+        self.stopped = False
+
+    def record(self, name: str, role: str, allowed: bool) -> None:
+        """
+        Add decision to the buffer
+        :param name: qualified name of the function
+        :param role: role of the principal
+        :param allowed: whether access was granted
+        :return: None
+        """
+        buffer = self.buffer
+        if len(buffer) >= self.capacity:
+            if not self.wait_for_space():
+                with self.stats_lock:
+                    self.dropped += 1
+                return
+
+        buffer.append((time.time(), name, role, allowed))
+        if len(buffer) >= self.batch_size:
+            self.wakeup.set()
+
+    def wait_for_space(self) -> bool:
+        self.wakeup.set()
+        if not self.block or self.thread is None:
+            return False
+        with self.space:
+            while len(self.buffer) >= self.capacity and not self.stopped:
+                self.space.wait(self.flush_interval)
+        return not self.stopped
+
+    def start(self) -> "AuditSink":
+        """
+        Start background flushing thread
+        :return: self
+        """
+        self.thread = threading.Thread(target=self.run, name="audit-sink", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self) -> None:
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all buffered records in batches
+        :return: None
+        """
+        buffer = self.buffer
+        while buffer:
+            batch = []
+            while buffer and len(batch) < self.batch_size:
+                batch.append(buffer.popleft())
+
+            with self.space:
+                self.space.notify_all()
+            if not self.write(batch):
+                with self.stats_lock:
+                    self.failed += len(batch)
+                continue
+
+            # Aggregation happens here, off the callers' path
+            with self.stats_lock:
+                for _, name, _, allowed in batch:
+                    self.decisions[name][not allowed] += 1
+                self.written += len(batch)
+
+    def write(self, batch: list[tuple]) -> bool:
+        """
+        Write batch retrying with backoff, writer errors never stop the flushing thread
+        :param batch: list of records
+        :return: whether the batch was written
+        """
+        delay = AUDIT_RETRY_DELAY
+        for attempt in range(AUDIT_WRITE_ATTEMPTS):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            try:
+                self.writer.write_batch(batch)
+                return True
+            except Exception as e:
+                self.last_error = e
+        return False
+
+    def close(self) -> None:
+        """
+        Stop flushing thread, write remaining records and close the writer
+        :return: None
+        """
+        self.stopped = True
+        self.wakeup.set()
+        with self.space:
+            self.space.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        self.writer.close()
+
+    def stats(self) -> dict:
+        """
+        Aggregated decisions of written records for dashboards
+        :return: dict with per function allow/deny counts and rates, and buffer counters
+        """
+        with self.stats_lock:
+            elapsed = max(time.monotonic() - self.started_at, 1e-9)
+            functions = {}
+            for name, (allowed, denied) in self.decisions.items():
+                functions[name] = {
+                    "allowed": allowed,
+                    "denied": denied,
+                    "allow_ratio": allowed / (allowed + denied),
+                    "allowed_per_sec": allowed / elapsed,
+                    "denied_per_sec": denied / elapsed,
+                }
+            return {
+                "functions": functions,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "last_error": repr(self.last_error) if self.last_error is not None else None,
+                "pending": len(self.buffer),
+            }
+
+    def __enter__(self) -> "AuditSink":
+        return self.start()
 
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
 
-def access_control(roles):
+
+def access_control(roles, policy: AccessPolicy = DEFAULT_POLICY, audit: AuditSink = None):
     def decorator(func):
+        required = policy.compile(roles)
+        masks = policy.masks
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        def check() -> None:
+            role = _current_role.get(CURRENT_USER_ROLE)
+            try:
+                mask = masks[role]
+            except KeyError:
+                mask = policy.mask_for(role)
+            if audit is not None:
+                audit.record(name, role, bool(mask & required))
+            if not mask & required:
+                raise PermissionError("User has no access to this function")
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                check()
+                return await func(*args, **kwargs)
+
+            return wrapper
+
+        if audit is not None:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                check()
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            role = get_user_role()
-            if role in roles:
+            # Check is inlined, this wrapper is on the hot path
+            role = _current_role.get(CURRENT_USER_ROLE)
+            try:
+                mask = masks[role]
+            except KeyError:
+                mask = policy.mask_for(role)
+            if mask & required:
                 return func(*args, **kwargs)
             else:
                 raise PermissionError("User has no access to this function")
@@ -53,7 +419,155 @@ class DecTestCase(unittest.TestCase):
         self.assertTrue("User has no access to this function" in str(context.exception))
 
 
-if __name__ == '__main__':
-    unittest.main()
+class PolicyTestCase(unittest.TestCase):
+    def test_hierarchy(self):
+        with user_role("admin"):
+            self.assertEqual(sum_many(1, 2, c=3, d=4), 10)
+            self.assertEqual(multiply(3, 4), 12)
+        with user_role("user"):
+            self.assertEqual(sum(1, 2), 3)
+            with self.assertRaises(PermissionError):
+                sum_many(1, 2, c=3, d=4)
+
+    def test_wildcards(self):
+        policy = AccessPolicy({"support:lead": ["support:agent"]})
+
+        @access_control(roles=["support:*"], policy=policy)
+        def support_only():
+            return True
+
+        @access_control(roles=["*"], policy=policy)
+        def anyone():
+            return True
+
+        with user_role("support:agent"):
+            self.assertTrue(support_only())
+        with user_role("guest"):
+            self.assertTrue(anyone())
+            with self.assertRaises(PermissionError):
+                support_only()
+
+    def test_late_roles(self):
+        policy = AccessPolicy()
+
+        @access_control(roles=["editor"], policy=policy)
+        def edit():
+            return True
+
+        with user_role("chief"):
+            with self.assertRaises(PermissionError):
+                edit()
+            policy.add_role("chief", ["editor"])
+            self.assertTrue(edit())
+
+    def test_threads_isolated(self):
+        def call_as(role):
+            with user_role(role):
+                try:
+                    return multiply(2, 3)
+                except PermissionError:
+                    return None
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(call_as, ["admin", "user"] * 10))
+        self.assertEqual(results, [6, None] * 10)
+        self.assertEqual(get_user_role(), "moderator")
 
+    def test_async(self):
+        @access_control(roles=["admin"])
+        async def async_multiply(a: int, b: int) -> int:
+            await asyncio.sleep(0)
+            return a * b
 
+        async def call_as(role):
+            set_user_role(role)
+            return await async_multiply(2, 3)
+
+        async def run():
+            results = await asyncio.gather(call_as("admin"), call_as("user"), return_exceptions=True)
+            self.assertEqual(results[0], 6)
+            self.assertIsInstance(results[1], PermissionError)
+
+        asyncio.run(run())
+
+
+class AuditTestCase(unittest.TestCase):
+    def test_jsonl(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = os.path.join(tmp, "audit.jsonl")
+            with AuditSink(JsonlAuditWriter(fp), batch_size=4, flush_interval=0.01) as sink:
+                @access_control(roles=["admin"], audit=sink)
+                def audited(a: int, b: int) -> int:
+                    return a * b
+
+                for role in ["admin", "user", "admin"]:
+                    with user_role(role):
+                        try:
+                            audited(2, 3)
+                        except PermissionError:
+                            pass
+
+            with open(fp) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(
+                [(r["role"], r["allowed"]) for r in records], [("admin", True), ("user", False), ("admin", True)]
+            )
+
+            stats = sink.stats()
+            self.assertEqual(stats["written"], 3)
+            decisions = stats["functions"][f"{__name__}.AuditTestCase.test_jsonl.<locals>.audited"]
+            self.assertEqual((decisions["allowed"], decisions["denied"]), (2, 1))
+
+    def test_sqlite_async(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = os.path.join(tmp, "audit.sqlite")
+            with AuditSink(SqliteAuditWriter(fp)) as sink:
+                @access_control(roles=["user"], audit=sink)
+                async def audited() -> bool:
+                    return True
+
+                self.assertTrue(asyncio.run(audited()))
+
+            connection = sqlite3.connect(fp)
+            self.assertEqual(connection.execute("SELECT role, allowed FROM audit").fetchall(), [("moderator", 1)])
+            connection.close()
+
+    def test_drops(self):
+        writer = unittest.mock.Mock()
+        sink = AuditSink(writer, capacity=2)
+
+        @access_control(roles=["admin"], audit=sink)
+        def audited():
+            return True
+
+        for _ in range(5):
+            with self.assertRaises(PermissionError):
+                audited()
+        sink.close()
+
+        self.assertEqual(sink.stats()["dropped"], 3)
+        self.assertEqual(sink.stats()["written"], 2)
+        writer.close.assert_called_once()
+
+    def test_writer_errors(self):
+        writer = unittest.mock.Mock()
+        # First batch fails every attempt, the second one succeeds on retry
+        writer.write_batch.side_effect = [OSError("disk full")] * AUDIT_WRITE_ATTEMPTS + [OSError("disk full"), None]
+        with unittest.mock.patch(f"{__name__}.AUDIT_RETRY_DELAY", 0.001):
+            with AuditSink(writer, batch_size=1, flush_interval=0.01) as sink:
+                sink.record("f", "user", True)
+                deadline = time.monotonic() + 5
+                while sink.stats()["failed"] == 0 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertTrue(sink.thread.is_alive())
+                sink.record("f", "user", False)
+
+        stats = sink.stats()
+        self.assertEqual((stats["failed"], stats["written"]), (1, 1))
+        self.assertEqual(stats["last_error"], repr(OSError("disk full")))
+        self.assertEqual(writer.write_batch.call_count, AUDIT_WRITE_ATTEMPTS + 2)
+        writer.close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import functools
+import os
+import random
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+from main import lru_cache
+
+# Amount of cached calls made by every thread
+CALLS_PER_THREAD = 100_000
+# Amount of distinct keys, bigger than maxsize so that evictions happen too
+KEY_SPACE = 2_000
+MAXSIZE = 1_024
+
+
+def square(x: int) -> int:
+    return x * x
+
+
+def add(a: int, b: int = 1, *, c: int = 0) -> int:
+    return a + b + c
+
+
+def run_hit_overhead(func, stmt: str, number: int = 200_000) -> float:
+    """
+    Measure time of a single cache hit
+    :param func: cached function, available as f in stmt
+    :param stmt: call statement to time
+    :param number: amount of calls
+    :return: nanoseconds per call
+    """
+    timer = timeit.Timer(stmt, globals={"f": func})
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e9
+
+
+def hammer(func, keys: list[int]) -> None:
+    """
+    Call cached function with every key from the list
+    :param func: cached function
+    :param keys: list of keys
+    :return: None
+    """
+    for key in keys:
+        func(key)
+
+
+def run_contention(func, threads: int) -> float:
+    """
+    Call cached function concurrently from several threads
+    :param func: cached function
+    :param threads: amount of threads
+    :return: calls per second
+    """
+    rnd = random.Random(threads)
+    workloads = [[rnd.randrange(KEY_SPACE) for _ in range(CALLS_PER_THREAD)] for _ in range(threads)]
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(hammer, [func] * threads, workloads))
+    all_time = time.perf_counter() - t_start
+
+    return threads * CALLS_PER_THREAD / all_time
+
+
+if __name__ == "__main__":
+    print("Per-hit overhead")
+    hit_implementations = {
+        "undecorated": add,
+        "functools.lru_cache": functools.lru_cache(maxsize=MAXSIZE)(add),
+        "lru_cache": lru_cache(maxsize=MAXSIZE)(add),
+        "lru_cache (typed)": lru_cache(maxsize=MAXSIZE, typed=True)(add),
+    }
+    for stmt in ["f(1, 2, c=3)", "f(1, 2)", "f(1)", "f(a=1, b=2)"]:
+        print("-" * 24)
+        print(stmt)
+        for name, func in hit_implementations.items():
+            print(f"{name:>24}: {run_hit_overhead(func, stmt):8.1f} ns/call")
+
+    implementations = {
+        "functools.lru_cache": lambda: functools.lru_cache(maxsize=MAXSIZE)(square),
+        "lru_cache (1 stripe)": lambda: lru_cache(maxsize=MAXSIZE, stripes=1)(square),
+        "lru_cache (16 stripes)": lambda: lru_cache(maxsize=MAXSIZE, stripes=16)(square),
+    }
+
+    for threads in sorted({1, 2, 4, os.cpu_count() or 1}):
+        print("-" * 24)
+        print(f"Threads: {threads}")
+        for name, make_cached in implementations.items():
+            cached = make_cached()
+            ops = run_contention(cached, threads)
+            info = cached.cache_info()
+            print(f"{name:>24}: {ops:12,.0f} calls/s, hits {info.hits}, misses {info.misses}")
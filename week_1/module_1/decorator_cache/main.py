@@ -1,25 +1,901 @@
 import unittest.mock
+import asyncio
 import collections
+import functools
+import inspect
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+# Default number of independently locked segments of a cache
+STRIPES = 16
+# Bounded caches are never split into segments smaller than this, so small caches keep exact LRU order
+MIN_SEGMENT_SIZE = 64
+# Min amount of seconds between two sweeps of expired entries
+SWEEP_INTERVAL = 1.
 
-def lru_cache(maxsize=None):
-    cache = collections.OrderedDict()
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize", "load_time", "expirations", "currbytes"]
+)
 
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    """
+    Estimate size of an object including the items of builtin containers
+    :param obj: object to measure
+    :param seen: ids of already counted objects
+    :return: size in bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += deep_sizeof(k, seen) + deep_sizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+
+    return size
+
+
+class LRUPolicy(collections.OrderedDict):
+    """
+    Least recently used eviction
+    """
+
+    def __init__(self, maxsize=None):
+        super().__init__()
+
+    def get(self, key, default=None):
+        """
+        Get value by key, recording the access
+        :param key: cache key
+        :param default: value to return if key is not cached
+        :return: cached value or default
+        """
+        try:
+            self.move_to_end(key)
+        except KeyError:
+            return default
+        return self[key]
+
+    def peek(self, key, default=None):
+        """
+        Get value by key without recording the access
+        """
+        return super().get(key, default)
+
+    def put(self, key, value) -> None:
+        """
+        Store a key that is not cached yet
+        """
+        self[key] = value
+
+    def evict(self) -> tuple:
+        """
+        Remove victim entry chosen by the policy
+        :return: evicted key and value
+        """
+        return self.popitem(last=False)
+
+
+class _FrequencyNode(object):
+    """
+    Keys accessed the same amount of times, nodes form a list sorted by frequency
+    """
+    __slots__ = ("count", "keys", "prev", "next")
+
+    def __init__(self, count: int, prev=None, next=None):
+        self.count = count
+        self.keys = collections.OrderedDict()
+        self.prev = prev
+        self.next = next
+
+
+class LFUPolicy(object):
+    """
+    Least frequently used eviction with O(1) operations, ties are broken by recency
+    """
+
+    def __init__(self, maxsize=None):
+        self.data = {}
+        # Sentinel node of a circular list of frequency nodes, head.next has the lowest frequency
+        self.head = _FrequencyNode(0)
+        self.head.prev = self.head.next = self.head
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __contains__(self, key) -> bool:
+        return key in self.data
+
+    def get(self, key, default=None):
+        try:
+            value, node = self.data[key]
+        except KeyError:
+            return default
+
+        next_node = node.next
+        if next_node.count != node.count + 1:
+            next_node = self._insert_after(node, node.count + 1)
+        del node.keys[key]
+        next_node.keys[key] = None
+        self.data[key] = (value, next_node)
+        if not node.keys:
+            self._unlink(node)
+
+        return value
+
+    def peek(self, key, default=None):
+        entry = self.data.get(key)
+        return default if entry is None else entry[0]
+
+    def put(self, key, value) -> None:
+        node = self.head.next
+        if node.count != 1:
+            node = self._insert_after(self.head, 1)
+        node.keys[key] = None
+        self.data[key] = (value, node)
+
+    def evict(self) -> tuple:
+        node = self.head.next
+        key, _ = node.keys.popitem(last=False)
+        if not node.keys:
+            self._unlink(node)
+        value, _ = self.data.pop(key)
+        return key, value
+
+    def pop(self, key, *default):
+        if key not in self.data and default:
+            return default[0]
+        value, node = self.data.pop(key)
+        del node.keys[key]
+        if not node.keys:
+            self._unlink(node)
+        return value
+
+    def clear(self) -> None:
+        self.data.clear()
+        self.head.prev = self.head.next = self.head
+
+    def _insert_after(self, node: _FrequencyNode, count: int) -> _FrequencyNode:
+        new_node = _FrequencyNode(count, node, node.next)
+        node.next.prev = new_node
+        node.next = new_node
+        return new_node
+
+    @staticmethod
+    def _unlink(node: _FrequencyNode) -> None:
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+
+class ARCPolicy(object):
+    """
+    Adaptive replacement cache: balances recently and frequently used lists using ghost entries of evicted keys
+    """
+
+    def __init__(self, maxsize=None):
+        if not maxsize:
+            raise ValueError("ARC policy requires maxsize")
+        self.maxsize = maxsize
+        # Target size of the recency list
+        self.p = 0
+        self.t1 = collections.OrderedDict()
+        self.t2 = collections.OrderedDict()
+        # Ghost lists remember only keys evicted from t1 and t2
+        self.b1 = collections.OrderedDict()
+        self.b2 = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.t1) + len(self.t2)
+
+    def __contains__(self, key) -> bool:
+        return key in self.t1 or key in self.t2
+
+    def get(self, key, default=None):
+        if key in self.t1:
+            value = self.t1.pop(key)
+            self.t2[key] = value
+            return value
+        try:
+            self.t2.move_to_end(key)
+        except KeyError:
+            return default
+        return self.t2[key]
+
+    def peek(self, key, default=None):
+        if key in self.t1:
+            return self.t1[key]
+        return self.t2.get(key, default)
+
+    def put(self, key, value) -> None:
+        if key in self.b1:
+            # Recently evicted key is back, give more room to recency
+            self.p = min(self.maxsize, self.p + max(len(self.b2) // len(self.b1), 1))
+            del self.b1[key]
+            self.t2[key] = value
+        elif key in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            del self.b2[key]
+            self.t2[key] = value
+        else:
+            self.t1[key] = value
+
+    def evict(self) -> tuple:
+        if self.t1 and (len(self.t1) > self.p or not self.t2):
+            key, value = self.t1.popitem(last=False)
+            self.b1[key] = None
+        else:
+            key, value = self.t2.popitem(last=False)
+            self.b2[key] = None
+
+        # Keep ghost lists within cache capacity
+        while len(self.b1) + len(self.b2) > self.maxsize:
+            ghosts = self.b1 if len(self.b1) > len(self.b2) else self.b2
+            ghosts.popitem(last=False)
+
+        return key, value
+
+    def pop(self, key, *default):
+        if key in self.t1:
+            return self.t1.pop(key)
+        return self.t2.pop(key, *default)
+
+    def clear(self) -> None:
+        self.p = 0
+        for entries in (self.t1, self.t2, self.b1, self.b2):
+            entries.clear()
+
+
+class CountMinSketch(object):
+    """
+    Approximate access frequencies of keys in 4-bit counters, halved periodically so that old popularity fades
+    """
+    SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+    MAX_COUNT = 15
+    MASK = 0xFFFFFFFFFFFFFFFF
+
+    def __init__(self, maxsize: int):
+        self.bits = max(4, (maxsize * 4 - 1).bit_length())
+        self.shift = 64 - self.bits
+        self.table = [[0] * (1 << self.bits) for _ in self.SEEDS]
+        self.sample_size = 10 * maxsize
+        self.additions = 0
+
+    def increment(self, key) -> None:
+        h = hash(key) & self.MASK
+        added = False
+        for row, seed in zip(self.table, self.SEEDS):
+            i = ((h * seed) & self.MASK) >> self.shift
+            if row[i] < self.MAX_COUNT:
+                row[i] += 1
+                added = True
+
+        if added:
+            self.additions += 1
+            if self.additions >= self.sample_size:
+                self.reset()
+
+    def frequency(self, key) -> int:
+        h = hash(key) & self.MASK
+        return min(row[((h * seed) & self.MASK) >> self.shift] for row, seed in zip(self.table, self.SEEDS))
+
+    def reset(self) -> None:
+        # Halving is O(width), but happens once per sample_size additions
+        for row in self.table:
+            for i, count in enumerate(row):
+                row[i] = count >> 1
+        self.additions //= 2
+
+
+class TinyLFUPolicy(object):
+    """
+    W-TinyLFU: new keys enter a small LRU window, and leave it for the main segmented LRU
+    only if their estimated frequency beats the frequency of the main victim
+    """
+
+    def __init__(self, maxsize=None):
+        if not maxsize:
+            raise ValueError("W-TinyLFU policy requires maxsize")
+        self.window_size = max(1, maxsize // 100)
+        self.main_size = max(0, maxsize - self.window_size)
+        self.protected_size = self.main_size * 4 // 5
+        self.window = collections.OrderedDict()
+        self.probation = collections.OrderedDict()
+        self.protected = collections.OrderedDict()
+        self.sketch = CountMinSketch(maxsize)
+
+    def __len__(self) -> int:
+        return len(self.window) + len(self.probation) + len(self.protected)
+
+    def __contains__(self, key) -> bool:
+        return key in self.window or key in self.probation or key in self.protected
+
+    def get(self, key, default=None):
+        # Misses are counted too, that's how keys not cached yet build up frequency for admission
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+            return self.window[key]
+        if key in self.probation:
+            value = self.probation.pop(key)
+            self.protected[key] = value
+            if len(self.protected) > self.protected_size:
+                demoted_key, demoted = self.protected.popitem(last=False)
+                self.probation[demoted_key] = demoted
+            return value
+        try:
+            self.protected.move_to_end(key)
+        except KeyError:
+            return default
+        return self.protected[key]
+
+    def peek(self, key, default=None):
+        for entries in (self.window, self.probation, self.protected):
+            if key in entries:
+                return entries[key]
+        return default
+
+    def put(self, key, value) -> None:
+        self.window[key] = value
+        # Window overflow goes straight to main while it has room
+        while len(self.window) > self.window_size and len(self.probation) + len(self.protected) < self.main_size:
+            candidate_key, candidate = self.window.popitem(last=False)
+            self.probation[candidate_key] = candidate
+
+    def evict(self) -> tuple:
+        main = self.probation or self.protected
+        if len(self.window) > self.window_size and main:
+            candidate_key, candidate = self.window.popitem(last=False)
+            victim_key = next(iter(main))
+            if self.sketch.frequency(candidate_key) > self.sketch.frequency(victim_key):
+                victim = main.pop(victim_key)
+                self.probation[candidate_key] = candidate
+                return victim_key, victim
+            return candidate_key, candidate
+
+        for entries in (self.probation, self.protected, self.window):
+            if entries:
+                return entries.popitem(last=False)
+        raise KeyError("evict from an empty cache")
+
+    def pop(self, key, *default):
+        for entries in (self.window, self.probation, self.protected):
+            if key in entries:
+                return entries.pop(key)
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def clear(self) -> None:
+        for entries in (self.window, self.probation, self.protected):
+            entries.clear()
+        self.sketch = CountMinSketch(self.window_size + self.main_size)
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "arc": ARCPolicy,
+    "tinylfu": TinyLFUPolicy,
+}
+
+
+# Marks keys of calls that don't match the signature, such calls raise TypeError and are never cached
+_INVALID_CALL = object()
+_MISSING = object()
+
+
+def _raw_key(args: tuple, kwargs: dict) -> tuple:
+    return _INVALID_CALL, args, tuple(sorted(kwargs.items()))
+
+
+def make_key_builder(func, typed: bool = False):
+    """
+    Precompute a cache key builder from the function signature, so that positional and keyword forms
+    of the same call, with defaults applied, share a key
+    :param func: function to build keys for
+    :param typed: whether arguments of different types are cached separately, e.g. 3 and 3.0
+    :return: callable taking args tuple and kwargs dict and returning a hashable key
+    """
+    try:
+        signature = inspect.signature(func)
+    except (TypeError, ValueError):
+        signature = None
+
+    if signature is None or any(
+            p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD) for p in signature.parameters.values()
+    ):
+        return _make_generic_key_builder(signature, typed)
+
+    params = list(signature.parameters.values())
+    size = len(params)
+    positional_count = len([p for p in params if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)])
+    index = {p.name: i for i, p in enumerate(params) if p.kind != p.POSITIONAL_ONLY}
+    defaults = [_MISSING if p.default is p.empty else p.default for p in params]
+    # Values appended to a positional-only call of each length, None if some of the rest have no default
+    tails = []
+    for count in range(positional_count + 1):
+        tail = tuple(defaults[count:])
+        tails.append(None if _MISSING in tail else tail)
+
+    def build_key(args: tuple, kwargs: dict) -> tuple:
+        if not kwargs:
+            count = len(args)
+            if count == size == positional_count:
+                # Fast path: all arguments passed positionally, args tuple is the key itself
+                return args
+            if count <= positional_count and tails[count] is not None:
+                return args + tails[count]
+            return _raw_key(args, kwargs)
+
+        if len(args) > positional_count:
+            return _raw_key(args, kwargs)
+        values = list(args)
+        values.extend(defaults[len(args):])
+        for name, value in kwargs.items():
+            i = index.get(name)
+            if i is None or i < len(args):
+                # Unknown keyword or argument passed twice
+                return _raw_key(args, kwargs)
+            values[i] = value
+        if _MISSING in values:
+            return _raw_key(args, kwargs)
+        return tuple(values)
+
+    if not typed:
+        return build_key
+
+    def build_typed_key(args: tuple, kwargs: dict) -> tuple:
+        key = build_key(args, kwargs)
+        if key and key[0] is _INVALID_CALL:
+            return key
+        return key + tuple(type(value) for value in key)
+
+    return build_typed_key
+
+
+def _make_generic_key_builder(signature, typed: bool):
+    # Signatures with *args or **kwargs are bound by inspect, slower but still normalized
+
+    def build_key(args: tuple, kwargs: dict) -> tuple:
+        if signature is None:
+            values = [*args, *(value for _, value in sorted(kwargs.items()))]
+            key = (args, tuple(sorted(kwargs.items())))
+        else:
+            try:
+                bound = signature.bind(*args, **kwargs)
+            except TypeError:
+                return _raw_key(args, kwargs)
+            bound.apply_defaults()
+            values = []
+            key = []
+            for name, value in bound.arguments.items():
+                kind = signature.parameters[name].kind
+                if kind == inspect.Parameter.VAR_KEYWORD:
+                    value = tuple(sorted(value.items()))
+                    values.extend(item for _, item in value)
+                elif kind == inspect.Parameter.VAR_POSITIONAL:
+                    values.extend(value)
+                else:
+                    values.append(value)
+                key.append(value)
+            key = tuple(key)
+
+        if typed:
+            # Types follow the normalized key, so keyword order of the call doesn't split entries
+            key += tuple(type(value) for value in values)
+        return key
+
+    return build_key
+
+
+class _Segment(object):
+    """
+    Part of the cache guarded by its own lock, keeps its own eviction policy state and counters.
+    Entries are stored as (value, size, expires_at) tuples
+    """
+
+    def __init__(self, maxsize=None, max_bytes=None, ttl=None, policy=LRUPolicy):
+        self.lock = threading.Lock()
+        self.data = policy(maxsize)
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # (expires_at, key) pairs in insertion order, which is also expiration order since ttl is the same for all
+        self.expiry_queue = collections.deque()
+        self.last_sweep = time.monotonic()
+        # Futures of coroutine calls being computed right now, shared by concurrent callers with the same key
+        self.inflight = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.load_time = 0.
+
+    def get(self, key, default):
+        """
+        Get value by key recording the access, expired entries are removed on access
+        :param key: cache key
+        :param default: value to return on a miss
+        :return: cached value or default
+        """
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, _, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size: int = 0, load_time: float = 0.) -> None:
+        """
+        Store value, evicting entries chosen by the policy while segment is over its entry or byte budget
+        :param key: cache key
+        :param value: value to store
+        :param size: estimated size of the value in bytes
+        :param load_time: time spent computing the value
+        :return: None
+        """
+        with self.lock:
+            self.load_time += load_time
+            if key in self.data:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Value would evict the whole segment and still not fit
+                return
+
+            expires_at = None
+            if self.ttl is not None:
+                now = time.monotonic()
+                if now - self.last_sweep >= SWEEP_INTERVAL:
+                    self._sweep(now)
+                expires_at = now + self.ttl
+                self.expiry_queue.append((expires_at, key))
+                if len(self.expiry_queue) > 2 * len(self.data) + 1:
+                    self._compact()
+
+            self.data.put(key, (value, size, expires_at))
+            self.bytes += size
+            while (self.maxsize and len(self.data) > self.maxsize) or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self.data.evict()
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def sweep(self) -> None:
+        """
+        Remove all expired entries
+        :return: None
+        """
+        if self.ttl is not None:
+            with self.lock:
+                self._sweep(time.monotonic())
+
+    def _sweep(self, now: float) -> None:
+        # Every queued pair is popped once, so sweeping is O(1) amortized per put
+        queue = self.expiry_queue
+        while queue and queue[0][0] <= now:
+            expires_at, key = queue.popleft()
+            entry = self.data.peek(key)
+            # Key could have been evicted or stored again since this pair was queued
+            if entry is not None and entry[2] == expires_at:
+                self._remove(key)
+                self.expirations += 1
+        self.last_sweep = now
+
+    def _compact(self) -> None:
+        # Pairs of evicted, removed or stored again keys stay queued until they expire otherwise,
+        # the queue is rebuilt once they outnumber live entries, so it's O(1) amortized per put
+        queue = collections.deque()
+        for expires_at, key in self.expiry_queue:
+            entry = self.data.peek(key)
+            if entry is not None and entry[2] == expires_at:
+                queue.append((expires_at, key))
+        self.expiry_queue = queue
+
+    def discard(self, key) -> None:
+        """
+        Remove entry if it is present
+        :param key: cache key
+        :return: None
+        """
+        with self.lock:
+            if key in self.data:
+                self._remove(key)
+
+    def _remove(self, key) -> None:
+        _, size, _ = self.data.pop(key)
+        self.bytes -= size
+
+    def clear(self, reset_stats: bool = True) -> None:
+        """
+        Remove all entries and reset counters
+        :param reset_stats: whether to reset hit/miss/eviction counters too
+        :return: None
+        """
+        with self.lock:
+            self.data.clear()
+            self.expiry_queue.clear()
+            self.inflight.clear()
+            self.bytes = 0
+            if reset_stats:
+                self.hits = self.misses = self.evictions = self.expirations = 0
+                self.load_time = 0.
+
+
+def make_segments(maxsize=None, stripes: int = STRIPES, max_bytes=None, ttl=None, policy="lru") -> list[_Segment]:
+    """
+    Split cache capacity between independently locked segments, caches with a byte budget get a single segment
+    :param maxsize: max amount of entries in the whole cache, None or 0 for unbounded
+    :param stripes: max amount of segments, ignored if max_bytes is set
+    :param max_bytes: max estimated size of all values in the whole cache, None for unbounded
+    :param ttl: seconds an entry stays valid after being stored, None for no expiration
+    :param policy: eviction policy name from POLICIES or a policy class
+    :return: list of segments
+    """
+    if isinstance(policy, str):
+        try:
+            policy = POLICIES[policy]
+        except KeyError:
+            raise ValueError(f"Unknown eviction policy {policy!r}, expected one of {list(POLICIES)}") from None
+
+    if max_bytes is not None:
+        # Byte budget is kept for the whole cache, a share of one stripe couldn't fit values
+        # larger than max_bytes / stripes
+        return [_Segment(maxsize or None, max_bytes, ttl, policy)]
+
+    count = stripes
+    if maxsize:
+        count = max(1, min(stripes, maxsize // MIN_SEGMENT_SIZE))
+
+    segments = []
+    for i in range(count):
+        segment_maxsize = maxsize // count + (i < maxsize % count) if maxsize else None
+        segments.append(_Segment(segment_maxsize, None, ttl, policy))
+
+    return segments
+
+
+def lru_cache(
+        maxsize=None,
+        stripes: int = STRIPES,
+        max_bytes=None,
+        sizeof=deep_sizeof,
+        ttl=None,
+        l2=None,
+        policy="lru",
+        typed: bool = False,
+):
+    """
+    Memoize function results in a thread-safe in-process cache, LRU by default
+    :param maxsize: max amount of entries, None or 0 for unbounded
+    :param stripes: max amount of independently locked segments, a cache with max_bytes has a single one
+    :param max_bytes: max estimated size of all cached values, None for unbounded
+    :param sizeof: callable estimating size of a value in bytes, deep_sizeof counts items of builtin containers,
+        pass sys.getsizeof for a faster estimate of flat values
+    :param ttl: seconds an entry stays valid after being stored, None for no expiration
+    :param l2: optional shared second tier like redis_tier.RedisTier,
+        local misses fall through to it and its invalidation messages evict local entries,
+        it must never raise so that the function is computed locally when the tier is unavailable
+    :param policy: eviction policy name from POLICIES ("lru", "lfu", "arc", "tinylfu") or a policy class
+    :param typed: whether arguments of different types are cached separately, e.g. 3 and 3.0
+    :return: decorator
+    """
     def decorator(func):
+        segments = make_segments(maxsize, stripes, max_bytes, ttl, policy)
+        count = len(segments)
+        missing = object()
+
+        make_key = make_key_builder(func, typed)
+        # Second tier key -> local key of entries stored through the second tier, so that its invalidation
+        # messages can address local entries while local keys stay exact
+        l2_keys = {}
+        l2_lock = threading.Lock()
+
+        def make_l2_key(key):
+            # Keys without a stable encoding aren't shared, such calls are cached locally only
+            return l2.make_key(key) if l2 is not None else None
+
+        def store(segment: _Segment, key, result, load_time: float = 0., l2_key=None) -> None:
+            size = sizeof(result) if max_bytes is not None else 0
+            segment.put(key, result, size, load_time)
+            if l2_key is not None:
+                remember(l2_key, key)
+
+        def remember(l2_key, key) -> None:
+            with l2_lock:
+                l2_keys[l2_key] = key
+                cached = 0
+                for segment in segments:
+                    cached += len(segment.data)
+                if len(l2_keys) > 2 * cached + MIN_SEGMENT_SIZE:
+                    # Keys of evicted entries are dropped once they outnumber cached ones
+                    stale = [k for k, local in l2_keys.items() if local not in segments[hash(local) % count].data]
+                    for k in stale:
+                        del l2_keys[k]
+
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            key = (args, tuple(sorted(kwargs.items())))
-            if key in cache:
-                result = cache.pop(key)
-                cache[key] = result
+            key = make_key(args, kwargs)
+            segment = segments[hash(key) % count]
+            result = segment.get(key, missing)
+            if result is not missing:
                 return result
-            elif maxsize and len(cache) >= maxsize:
-                cache.popitem(last=False)
 
+            l2_key = make_l2_key(key)
+            if l2_key is not None:
+                found = l2.get_many([l2_key])
+                if l2_key in found:
+                    store(segment, key, found[l2_key], l2_key=l2_key)
+                    return found[l2_key]
+
+            t_start = time.perf_counter()
             result = func(*args, **kwargs)
-            cache[key] = result
+            store(segment, key, result, time.perf_counter() - t_start, l2_key)
+            if l2_key is not None:
+                l2.set(l2_key, result)
 
             return result
 
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            segment = segments[hash(key) % count]
+            loop = asyncio.get_running_loop()
+
+            while True:
+                result = segment.get(key, missing)
+                if result is not missing:
+                    return result
+
+                with segment.lock:
+                    future = segment.inflight.get(key)
+                    # Futures can't be awaited from another event loop, such callers compute on their own
+                    is_leader = future is None or future.get_loop() is not loop
+                    if is_leader:
+                        future = loop.create_future()
+                        segment.inflight[key] = future
+
+                if is_leader:
+                    break
+
+                try:
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+                    # Leader was cancelled, the next caller becomes a leader and computes again
+
+            try:
+                found = {}
+                l2_key = make_l2_key(key)
+                if l2_key is not None:
+                    # Second tier client is blocking, keep it off the event loop
+                    found = await loop.run_in_executor(None, l2.get_many, [l2_key])
+
+                if l2_key in found:
+                    result = found[l2_key]
+                    store(segment, key, result, l2_key=l2_key)
+                else:
+                    t_start = time.perf_counter()
+                    result = await func(*args, **kwargs)
+                    store(segment, key, result, time.perf_counter() - t_start, l2_key)
+                    if l2_key is not None:
+                        await loop.run_in_executor(None, l2.set, l2_key, result)
+            except BaseException as e:
+                with segment.lock:
+                    if segment.inflight.get(key) is future:
+                        del segment.inflight[key]
+                # Exceptions are passed to waiting callers, but never cached
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    # Mark exception as retrieved in case nobody was waiting
+                    future.exception()
+                raise
+
+            with segment.lock:
+                if segment.inflight.get(key) is future:
+                    del segment.inflight[key]
+            future.set_result(result)
+
+            return result
+
+        def cache_info() -> CacheInfo:
+            hits = misses = evictions = expirations = currsize = currbytes = 0
+            load_time = 0.
+            for segment in segments:
+                with segment.lock:
+                    hits += segment.hits
+                    misses += segment.misses
+                    evictions += segment.evictions
+                    expirations += segment.expirations
+                    currsize += len(segment.data)
+                    currbytes += segment.bytes
+                    load_time += segment.load_time
+            return CacheInfo(hits, misses, evictions, maxsize, currsize, load_time, expirations, currbytes)
+
+        def cache_clear() -> None:
+            for segment in segments:
+                segment.clear()
+            if l2 is not None:
+                with l2_lock:
+                    l2_keys.clear()
+                l2.clear()
+
+        def cache_delete(*args, **kwargs) -> None:
+            key = make_key(args, kwargs)
+            segments[hash(key) % count].discard(key)
+            l2_key = make_l2_key(key)
+            if l2_key is not None:
+                l2.delete([l2_key])
+
+        def cache_prefetch(calls) -> int:
+            """
+            Load results of many calls from the second tier in one round trip
+            :param calls: iterable of positional args tuples
+            :return: amount of entries loaded
+            """
+            if l2 is None:
+                return 0
+            keys = {}
+            for args in calls:
+                key = make_key(args, {})
+                l2_key = make_l2_key(key)
+                if l2_key is not None:
+                    keys[l2_key] = key
+            found = l2.get_many(list(keys))
+            for l2_key, result in found.items():
+                key = keys[l2_key]
+                store(segments[hash(key) % count], key, result, l2_key=l2_key)
+            return len(found)
+
+        def cache_sweep() -> None:
+            for segment in segments:
+                segment.sweep()
+
+        def invalidate(keys) -> None:
+            # Called from the second tier listener when any process deletes keys or clears the cache
+            if keys is None:
+                with l2_lock:
+                    l2_keys.clear()
+                for segment in segments:
+                    segment.clear(reset_stats=False)
+            else:
+                for l2_key in keys:
+                    with l2_lock:
+                        key = l2_keys.pop(l2_key, None)
+                    if key is not None:
+                        segments[hash(key) % count].discard(key)
+
+        if l2 is not None:
+            l2.subscribe(invalidate)
+
+        if inspect.iscoroutinefunction(func):
+            wrapper = async_wrapper
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_delete = cache_delete
+        wrapper.cache_prefetch = cache_prefetch
+        wrapper.cache_sweep = cache_sweep
         return wrapper
 
     return decorator
@@ -63,3 +939,168 @@ if __name__ == '__main__':
     assert decorated(1, 2, c=3, d=4) == 5
     assert decorated(1, 2, c=3, d=4) == 5
     assert mocked_func.call_count == 5
+
+    info = decorated.cache_info()
+    assert (info.hits, info.misses, info.evictions, info.maxsize, info.currsize) == (4, 5, 3, 2, 2)
+    decorated.cache_clear()
+    assert decorated.cache_info()[:5] == (0, 0, 0, 2, 0)
+
+    # Positional and keyword forms of a call share an entry, defaults are applied
+    mocked_func = unittest.mock.Mock(side_effect=lambda a, b=10, *, c=0: a + b + c)
+
+    def add(a, b=10, *, c=0):
+        return mocked_func(a, b, c=c)
+
+    normalized = lru_cache()(add)
+    assert normalized(1, 2) == 3
+    assert normalized(1, b=2) == 3
+    assert normalized(a=1, b=2) == 3
+    assert normalized(b=2, a=1, c=0) == 3
+    assert normalized(1, 10) == 11
+    assert normalized(1) == 11
+    assert normalized(1, c=1) == 12
+    assert mocked_func.call_count == 3
+    try:
+        normalized(1, a=1)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("argument passed twice must raise TypeError")
+    assert normalized.cache_info().currsize == 3
+
+    # Keyword-only arguments passed positionally must raise as in the undecorated function
+    def keyword_only(a, b, *, c, d):
+        return a + b + c + d
+
+    def keyword_default(a, *, c=5):
+        return a + c
+
+    for decorated, call, args in [
+        (lru_cache()(keyword_only), lambda f: f(1, 2, c=3, d=4), (1, 2, 3, 4)),
+        (lru_cache()(keyword_default), lambda f: f(1), (1, 5)),
+    ]:
+        call(decorated)
+        try:
+            decorated(*args)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("keyword-only argument passed positionally must raise TypeError")
+
+    typed_sum = lru_cache(typed=True)(add)
+    assert typed_sum(1) == 11
+    assert typed_sum(1.0) == 11.0
+    assert typed_sum.cache_info().currsize == 2
+
+    typed_kwargs = lru_cache(typed=True)(lambda **kwargs: kwargs["a"] + kwargs["b"])
+    assert typed_kwargs(a=1, b=2.0) == 3.0
+    assert typed_kwargs(b=2.0, a=1) == 3.0
+    assert typed_kwargs.cache_info().hits == 1
+    assert typed_kwargs(a=1, b=2) == 3
+    assert typed_kwargs.cache_info().currsize == 2
+
+    # Concurrent access from many threads must keep counters and size consistent
+    threaded = lru_cache(maxsize=1000)(lambda x: x * 2)
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(threaded, [i % 1500 for i in range(30000)]))
+    assert results == [(i % 1500) * 2 for i in range(30000)]
+    info = threaded.cache_info()
+    assert info.hits + info.misses == 30000
+    assert info.currsize <= 1000
+    assert info.currsize <= info.misses - info.evictions
+
+    # Byte budget evicts least recently used values until the new one fits
+    sized = lru_cache(max_bytes=10, sizeof=len)(lambda n: "x" * n)
+    sized(4)
+    sized(4)
+    sized(3)
+    sized(4)
+    sized(5)
+    info = sized.cache_info()
+    assert (info.hits, info.evictions, info.currsize, info.currbytes) == (2, 1, 2, 9)
+    sized(11)
+    assert sized.cache_info().currbytes == 9
+
+    # Values larger than max_bytes / STRIPES are cached too, nested values are measured deeply
+    large = lru_cache(max_bytes=1000, sizeof=len)(lambda n: "x" * n)
+    large(100)
+    large(100)
+    assert large.cache_info().hits == 1
+    nested = lru_cache(max_bytes=5000)(lambda n: [[0] * 100 for _ in range(n)])
+    nested(1)
+    nested(10)
+    info = nested.cache_info()
+    assert info.currsize == 1 and info.currbytes == deep_sizeof(nested(1))
+
+    # Entries expire lazily on access and through periodic sweeps
+    with unittest.mock.patch("time.monotonic") as monotonic:
+        monotonic.return_value = 100.
+        mocked_func = unittest.mock.Mock()
+        mocked_func.side_effect = [1, 2, 3, 4]
+        expiring = lru_cache(ttl=5, stripes=1)(mocked_func)
+        assert expiring(1) == 1
+        monotonic.return_value = 103.
+        assert expiring(2) == 2
+        assert expiring(1) == 1
+        monotonic.return_value = 105.
+        assert expiring(1) == 3
+        monotonic.return_value = 109.
+        expiring.cache_sweep()
+        info = expiring.cache_info()
+        assert (info.expirations, info.currsize) == (2, 1)
+        assert expiring(1) == 3
+        assert mocked_func.call_count == 3
+
+    # Expiry queue doesn't keep pairs of evicted entries until they expire
+    segment = _Segment(maxsize=10, ttl=3600)
+    for i in range(200_000):
+        segment.put(i, i)
+    assert len(segment.data) == 10 and len(segment.expiry_queue) <= 21
+    segment.sweep()
+    assert len(segment.data) == 10
+
+    # Concurrent misses of a coroutine share a single call, exceptions are not cached
+    calls = []
+
+    @lru_cache(maxsize=10)
+    async def slow_double(x: int) -> int:
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        if x < 0:
+            raise ValueError(x)
+        return x * 2
+
+    async def check_async():
+        assert await asyncio.gather(*[slow_double(i % 2) for i in range(10)]) == [0, 2] * 5
+        assert calls == [0, 1]
+        assert await slow_double(1) == 2
+        assert calls == [0, 1]
+
+        results = await asyncio.gather(*[slow_double(-1) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert calls == [0, 1, -1]
+        try:
+            await slow_double(-1)
+        except ValueError:
+            pass
+        assert calls == [0, 1, -1, -1]
+
+    asyncio.run(check_async())
+    assert slow_double.cache_info().currsize == 2
+
+    # Every policy keeps its capacity, and frequency-aware ones survive a scan
+    for name in POLICIES:
+        scanned = lru_cache(maxsize=100, stripes=1, policy=name)(lambda x: x)
+        for _ in range(5):
+            for i in range(50):
+                scanned(i)
+        for i in range(1000, 2000):
+            scanned(i)
+            assert scanned.cache_info().currsize <= 100
+        hits_before = scanned.cache_info().hits
+        for i in range(50):
+            scanned(i)
+        if name != "lru":
+            assert scanned.cache_info().hits - hits_before > 0, name
+        else:
+            assert scanned.cache_info().hits == hits_before
@@ -0,0 +1,338 @@
+import hashlib
+import json
+import logging
+import pickle
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+import redis
+
+# Max amount of keys fetched or deleted by a single pipelined command
+BATCH_SIZE = 500
+# Message sent over the invalidation channel when the whole cache is cleared
+CLEAR_ALL = "*"
+# Seconds redis is not called after a failed command, calls in between are treated as misses
+ERROR_COOLDOWN = 5.
+# Seconds before the listener reconnects after losing the connection, doubled up to MAX_RECONNECT_DELAY
+RECONNECT_DELAY = 0.1
+MAX_RECONNECT_DELAY = 10.
+# Seconds the listener waits for a message before checking whether it is stopped
+LISTEN_TIMEOUT = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+def encode_key(value, parts: list[str]) -> None:
+    """
+    Append encoding of a cache key that doesn't depend on the process: unlike repr, sets are sorted
+    and objects whose repr may contain an address or depend on hash randomization are rejected
+    :param value: cache key or its part
+    :param parts: list of strings to append to
+    :return: None
+    """
+    if value is None or isinstance(value, (bool, int, float, complex)):
+        parts.append(f"{type(value).__name__}:{value!r};")
+    elif isinstance(value, str):
+        # Length prefix keeps strings containing separators unambiguous
+        parts.append(f"s{len(value)}:{value}")
+    elif isinstance(value, bytes):
+        parts.append(f"b{len(value)}:{value.hex()}")
+    elif isinstance(value, (tuple, list)):
+        parts.append("(" if isinstance(value, tuple) else "[")
+        for item in value:
+            encode_key(item, parts)
+        parts.append(")")
+    elif isinstance(value, (set, frozenset)):
+        items = []
+        for item in value:
+            item_parts = []
+            encode_key(item, item_parts)
+            items.append("".join(item_parts))
+        parts.append("{" + "".join(sorted(items)) + "}")
+    elif isinstance(value, dict):
+        items = []
+        for k, v in value.items():
+            item_parts = []
+            encode_key(k, item_parts)
+            encode_key(v, item_parts)
+            items.append("".join(item_parts))
+        parts.append("<" + "".join(sorted(items)) + ">")
+    elif isinstance(value, type):
+        parts.append(f"t{value.__module__}.{value.__qualname__};")
+    else:
+        raise TypeError(f"Cache key part of type {type(value).__name__} has no stable encoding")
+
+
+class RedisTier:
+    """
+    Shared second cache tier kept in redis. Values are stored with a pluggable serializer,
+    deletes and clears are broadcast over a pub/sub channel so every process can evict its local copies.
+    Redis errors never reach the cached function: they are logged and counted, failed reads are misses
+    and redis is left alone for ERROR_COOLDOWN seconds, so the function is computed locally meanwhile
+    """
+
+    def __init__(
+            self,
+            client: redis.Redis,
+            name: str,
+            namespace: str = "cache",
+            serializer=pickle,
+            ttl: Optional[int] = None,
+    ):
+        """
+        :param client: redis.Redis client
+        :param name: cache name, must be the same for a function in all processes
+        :param namespace: prefix for all keys and the invalidation channel
+        :param serializer: object with dumps and loads methods, e.g. pickle or json module
+        :param ttl: seconds values are kept in redis, None to keep until evicted by redis
+        """
+        self.client = client
+        self.serializer = serializer
+        self.ttl = ttl
+        self.prefix = f"{namespace}:{name}:"
+        self.channel = f"{namespace}:{name}:invalidate"
+        self.callbacks = []
+        self.listener = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.reconnects = 0
+        # time.monotonic() until which redis is not called after an error
+        self.retry_at = 0.
+
+    def make_key(self, key) -> Optional[str]:
+        """
+        Make redis key from a local cache key, the same in every process
+        :param key: local cache key
+        :return: string key, None if key has values without a stable encoding, e.g. objects with default repr
+        """
+        parts = []
+        try:
+            encode_key(key, parts)
+        except TypeError:
+            return None
+        encoded = "".join(parts).encode("utf-8", "surrogatepass")
+        return self.prefix + hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.retry_at
+
+    def record_error(self, operation: str, error: Exception) -> None:
+        with self.lock:
+            self.errors += 1
+        self.retry_at = time.monotonic() + ERROR_COOLDOWN
+        logger.warning("Redis tier %s failed to %s: %r", self.prefix, operation, error)
+
+    def get_many(self, keys: list[str]) -> dict:
+        """
+        Fetch many keys using pipelined MGET commands, all keys are missing if redis fails
+        :param keys: list of keys made by make_key
+        :return: dict with values of the keys present in redis
+        """
+        if not self.available():
+            self.misses += len(keys)
+            return {}
+        try:
+            return self._get_many(keys)
+        except redis.RedisError as e:
+            self.record_error("get", e)
+            self.misses += len(keys)
+            return {}
+
+    def _get_many(self, keys: list[str]) -> dict:
+        batches = [keys[i:i + BATCH_SIZE] for i in range(0, len(keys), BATCH_SIZE)]
+        pipe = self.client.pipeline(transaction=False)
+        for batch in batches:
+            pipe.mget(batch)
+
+        found = {}
+        for batch, items in zip(batches, pipe.execute()):
+            for key, item in zip(batch, items):
+                if item is not None:
+                    found[key] = self.serializer.loads(item)
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key: str, value) -> None:
+        """
+        Store a value
+        :param key: key made by make_key
+        :param value: value to store
+        :return: None
+        """
+        if not self.available():
+            return
+        try:
+            self.client.set(key, self.serializer.dumps(value), ex=self.ttl)
+        except redis.RedisError as e:
+            self.record_error("set", e)
+
+    def delete(self, keys: list[str]) -> None:
+        """
+        Delete keys and notify all processes to evict them
+        :param keys: list of keys made by make_key
+        :return: None
+        """
+        if not keys:
+            return
+        try:
+            self.client.delete(*keys)
+            self.client.publish(self.channel, json.dumps(keys))
+        except redis.RedisError as e:
+            self.record_error("delete", e)
+
+    def clear(self) -> None:
+        """
+        Delete all keys of the cache and notify all processes to clear their local caches
+        :return: None
+        """
+        try:
+            self._clear()
+        except redis.RedisError as e:
+            self.record_error("clear", e)
+
+    def _clear(self) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        batch = []
+        for key in self.client.scan_iter(match=self.prefix + "*", count=BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= BATCH_SIZE:
+                pipe.delete(*batch)
+                batch = []
+        if batch:
+            pipe.delete(*batch)
+        pipe.execute()
+        self.client.publish(self.channel, CLEAR_ALL)
+
+    def subscribe(self, callback: Callable[[Optional[Iterable[str]]], None]) -> None:
+        """
+        Call callback with a list of deleted keys, or None when cache is cleared, whenever any process invalidates.
+        The listening thread connects in background and reconnects with backoff, so it works while redis is down
+        :param callback: callable
+        :return: None
+        """
+        with self.lock:
+            self.callbacks.append(callback)
+            if self.listener is None:
+                self.stopped.clear()
+                self.listener = threading.Thread(target=self.listen, name=f"{self.channel}-listener", daemon=True)
+                self.listener.start()
+
+    def listen(self) -> None:
+        delay = RECONNECT_DELAY
+        disconnected = False
+        while not self.stopped.is_set():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                if disconnected:
+                    # Invalidations sent while disconnected are lost, so local entries can't be trusted
+                    self.reconnects += 1
+                    self.notify(None)
+                disconnected = False
+                delay = RECONNECT_DELAY
+                while not self.stopped.is_set():
+                    message = pubsub.get_message(timeout=LISTEN_TIMEOUT)
+                    if message is not None:
+                        self.handle_message(message)
+            except redis.RedisError as e:
+                self.record_error("listen", e)
+                disconnected = True
+                self.stopped.wait(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                pubsub.close()
+
+    def handle_message(self, message: dict) -> None:
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode()
+        self.notify(None if data == CLEAR_ALL else json.loads(data))
+
+    def notify(self, keys: Optional[list[str]]) -> None:
+        for callback in self.callbacks:
+            callback(keys)
+
+    def close(self) -> None:
+        """
+        Stop listening to invalidation messages
+        :return: None
+        """
+        with self.lock:
+            listener, self.listener = self.listener, None
+        if listener is not None:
+            self.stopped.set()
+            listener.join()
+
+
+if __name__ == '__main__':
+    import time
+    import unittest.mock
+
+    from main import lru_cache
+
+    # Redis being down doesn't break the function, it is computed locally
+    down_tier = RedisTier(redis.Redis(port=1, retry=None), "down")
+    down = lru_cache(maxsize=10, l2=down_tier)(lambda x: x * 2)
+    assert [down(1), down(1), down(2)] == [2, 2, 4]
+    assert down.cache_info().hits == 1
+    down.cache_delete(1)
+    down.cache_clear()
+    assert down.cache_prefetch([(3,)]) == 0
+    assert down_tier.errors >= 1 and down_tier.misses == 3
+
+    # Local keys stay exact, arguments without a stable encoding are cached locally only
+    class Point(object):
+        def __init__(self, x):
+            self.x = x
+
+        def __repr__(self):
+            return "Point"
+
+    points = lru_cache(maxsize=10, l2=down_tier)(lambda p: p.x)
+    first_point, second_point = Point(1), Point(2)
+    assert (points(first_point), points(second_point), points(first_point)) == (1, 2, 1)
+    assert down_tier.make_key((first_point,)) is None
+    # Redis keys don't depend on iteration order of sets, which changes with hash randomization
+    assert down_tier.make_key((frozenset(["a", "b", "c"]),)) == down_tier.make_key((frozenset(["c", "b", "a"]),))
+    assert down_tier.make_key((1, "2")) != down_tier.make_key(("1", 2))
+    down_tier.close()
+
+    r_client = redis.Redis()
+
+    # Two caches with the same tier name behave like the same function in two processes
+    mocked_func = unittest.mock.Mock()
+    mocked_func.side_effect = [1, 2, 3, 4]
+    first = lru_cache(maxsize=10, l2=RedisTier(r_client, "test"))(mocked_func)
+    second = lru_cache(maxsize=10, l2=RedisTier(r_client, "test"))(mocked_func)
+    first.cache_clear()
+    time.sleep(0.5)
+
+    assert first(1) == 1
+    assert second(1) == 1
+    assert mocked_func.call_count == 1
+    assert second.cache_info().currsize == 1
+
+    # Deleting a key in one process evicts it everywhere
+    first.cache_delete(1)
+    time.sleep(0.5)
+    assert second.cache_info().currsize == 0
+    assert second(1) == 2
+    assert first(1) == 2
+
+    # Clearing in one process clears every process
+    assert first(2) == 3
+    second.cache_clear()
+    time.sleep(0.5)
+    assert first.cache_info().currsize == 0
+
+    # Prefetch pulls many entries in one round trip
+    assert first(2) == 4
+    assert second.cache_prefetch([(2,), (3,)]) == 1
+    assert second(2) == 4
+    assert mocked_func.call_count == 4
@@ -0,0 +1,108 @@
+import argparse
+import csv
+import json
+import random
+import time
+import tracemalloc
+from typing import Iterator
+
+from main import POLICIES, lru_cache
+
+
+def read_trace(fp: str) -> Iterator:
+    """
+    Read recorded keys from a trace file.
+    JSONL lines hold either a key or an object with "key" field, CSV files use "key" column or the first one
+    :param fp: path to .jsonl or .csv file
+    :return: iterator over keys
+    """
+    with open(fp, newline="") as f:
+        if fp.endswith(".csv"):
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            column = header.index("key") if "key" in header else 0
+            if "key" not in header:
+                yield header[column]
+            for row in reader:
+                yield row[column]
+        else:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    yield item["key"] if isinstance(item, dict) else item
+
+
+def generate_trace(n: int = 200_000, hot_keys: int = 2_000, scan_length: int = 2_000, seed: int = 0) -> list[int]:
+    """
+    Generate scan-heavy trace: skewed accesses to a hot set interleaved with long sequential scans
+    :param n: amount of accesses
+    :param hot_keys: size of the hot set
+    :param scan_length: amount of keys in a single scan
+    :param seed: random seed
+    :return: list of keys
+    """
+    rnd = random.Random(seed)
+    trace = []
+    scan_start = 1_000_000
+    while len(trace) < n:
+        trace.extend(int(hot_keys * rnd.random() ** 3) for _ in range(scan_length))
+        trace.extend(range(scan_start, scan_start + scan_length))
+        scan_start += scan_length
+
+    return trace[:n]
+
+
+def replay(trace: list, policy: str, maxsize: int) -> dict:
+    """
+    Replay trace through a cache with the given policy
+    :param trace: list of keys
+    :param policy: policy name
+    :param maxsize: cache size
+    :return: dict with hit ratio, ops per second and peak memory
+    """
+    cached = lru_cache(maxsize=maxsize, stripes=1, policy=policy)(lambda key: key)
+    t_start = time.perf_counter()
+    for key in trace:
+        cached(key)
+    all_time = time.perf_counter() - t_start
+    info = cached.cache_info()
+
+    # Memory is measured in a separate run, tracing allocations slows every operation down
+    tracemalloc.start()
+    cached = lru_cache(maxsize=maxsize, stripes=1, policy=policy)(lambda key: key)
+    for key in trace:
+        cached(key)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "policy": policy,
+        "maxsize": maxsize,
+        "hit_ratio": info.hits / len(trace),
+        "ops_per_sec": len(trace) / all_time,
+        "peak_memory_bytes": peak,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay key traces through every eviction policy")
+    parser.add_argument("trace", nargs="?", help="path to .jsonl or .csv trace, synthetic scan-heavy trace if omitted")
+    parser.add_argument("--maxsize", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--policy", nargs="+", default=list(POLICIES), choices=list(POLICIES))
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    options = parser.parse_args()
+
+    keys = list(read_trace(options.trace)) if options.trace else generate_trace()
+    print(f"Replaying {len(keys)} accesses...")
+    for size in options.maxsize:
+        for name in options.policy:
+            result = replay(keys, name, size)
+            if options.json:
+                print(json.dumps(result))
+            else:
+                print(
+                    f"{name:>8} maxsize={size:<6} hit ratio {result['hit_ratio']:.4f}, "
+                    f"{result['ops_per_sec']:10,.0f} ops/s, peak memory {result['peak_memory_bytes'] / 1024:,.0f} KiB"
+                )
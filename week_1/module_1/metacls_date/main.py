@@ -1,10 +1,168 @@
 import datetime
+import json
+import sys
+import threading
+import time
+
+
+class ImportProfiler(object):
+    """
+    Opt-in recorder of class definition durations and module import times.
+    While disabled it costs classes created with CreatedAtMeta a single attribute check
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.classes = []
+        # Module name -> [cumulative import time, own time without nested imports]
+        self.modules = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.finder = _TimingFinder(self)
+
+    def enable(self) -> None:
+        """
+        Start recording classes and hook into imports
+        :return: None
+        """
+        self.enabled = True
+        if self.finder not in sys.meta_path:
+            sys.meta_path.insert(0, self.finder)
+
+    def disable(self) -> None:
+        """
+        Stop recording, collected data is kept
+        :return: None
+        """
+        self.enabled = False
+        if self.finder in sys.meta_path:
+            sys.meta_path.remove(self.finder)
+
+    def record_class(self, cls: type, duration: float) -> None:
+        with self.lock:
+            self.classes.append({
+                "name": cls.__qualname__,
+                "module": cls.__module__,
+                "duration": duration,
+                "timestamp": time.monotonic(),
+            })
+
+    def start_import(self) -> None:
+        stack = self.local.__dict__.setdefault("stack", [])
+        # Every frame is [start time, time spent in nested imports]
+        stack.append([time.perf_counter(), 0.])
+
+    def finish_import(self, name: str) -> None:
+        stack = self.local.stack
+        started, nested = stack.pop()
+        cumulative = time.perf_counter() - started
+        if stack:
+            stack[-1][1] += cumulative
+        with self.lock:
+            self.modules[name] = [cumulative, cumulative - nested]
+
+    def to_dict(self, limit: int = None) -> dict:
+        """
+        Slowest modules and classes
+        :param limit: max amount of modules and classes, all if None
+        :return: dict with modules sorted by cumulative import time and classes sorted by definition duration
+        """
+        with self.lock:
+            modules = [
+                {"name": name, "cumulative": cumulative, "self": own}
+                for name, (cumulative, own) in self.modules.items()
+            ]
+            classes = list(self.classes)
+        modules.sort(key=lambda module: module["cumulative"], reverse=True)
+        classes.sort(key=lambda item: item["duration"], reverse=True)
+
+        return {"modules": modules[:limit], "classes": classes[:limit]}
+
+    def to_json(self, limit: int = None) -> str:
+        return json.dumps(self.to_dict(limit), indent=2)
+
+    def report(self, limit: int = 20) -> str:
+        """
+        Text report of the slowest modules and classes
+        :param limit: max amount of modules and classes
+        :return: report
+        """
+        data = self.to_dict(limit)
+        lines = [f"{'cumulative, ms':>15} {'self, ms':>10}  module"]
+        for module in data["modules"]:
+            lines.append(f"{module['cumulative'] * 1000:15.3f} {module['self'] * 1000:10.3f}  {module['name']}")
+        lines.append("")
+        lines.append(f"{'duration, ms':>15}  class")
+        for item in data["classes"]:
+            lines.append(f"{item['duration'] * 1000:15.3f}  {item['module']}.{item['name']}")
+
+        return "\n".join(lines)
+
+
+class _TimingLoader(object):
+    """
+    Wraps module loader to time module execution, everything else is delegated to the original loader
+    """
+
+    def __init__(self, loader, profiler: ImportProfiler):
+        self.loader = loader
+        self.profiler = profiler
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        self.profiler.start_import()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler.finish_import(module.__name__)
+
+    def __getattr__(self, name: str):
+        return getattr(self.loader, name)
+
+
+class _TimingFinder(object):
+    """
+    Meta path finder that asks other finders for a module spec and wraps its loader
+    """
+
+    def __init__(self, profiler: ImportProfiler):
+        self.profiler = profiler
+
+    def find_spec(self, fullname: str, path=None, target=None):
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, "find_spec", None)
+            if finder is self or find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimingLoader(spec.loader, self.profiler)
+            return spec
+
+        return None
+
+
+PROFILER = ImportProfiler()
 
 
 class CreatedAtMeta(type):
+    @classmethod
+    def __prepare__(mcs, name, bases, **kwargs):
+        namespace = super().__prepare__(name, bases, **kwargs)
+        if PROFILER.enabled:
+            namespace["__definition_started__"] = time.perf_counter()
+        return namespace
+
     def __new__(cls, name, bases, attrs):
+        started = attrs.pop("__definition_started__", None)
         attrs["created_at"] = datetime.datetime.now()
-        return super().__new__(cls, name, bases, attrs)
+        new_cls = super().__new__(cls, name, bases, attrs)
+        if started is not None:
+            PROFILER.record_class(new_cls, time.perf_counter() - started)
+        return new_cls
 
 
 class MyClass(object, metaclass=CreatedAtMeta):
@@ -15,3 +173,31 @@ if __name__ == "__main__":
     myobj = MyClass()
     assert hasattr(myobj, "created_at")
     print(myobj.__getattribute__("created_at"))
+
+    # Nothing is recorded until profiler is enabled
+    class NotProfiled(object, metaclass=CreatedAtMeta):
+        pass
+
+    assert PROFILER.classes == []
+    assert not hasattr(NotProfiled, "__definition_started__")
+
+    PROFILER.enable()
+
+    class SlowClass(object, metaclass=CreatedAtMeta):
+        time.sleep(0.01)
+
+    import email.mime.text
+
+    PROFILER.disable()
+
+    data = PROFILER.to_dict()
+    assert [item["name"] for item in data["classes"]] == ["SlowClass"]
+    assert data["classes"][0]["duration"] >= 0.01
+    assert hasattr(SlowClass, "created_at")
+    assert not hasattr(SlowClass, "__definition_started__")
+
+    modules = {module["name"]: module for module in data["modules"]}
+    assert "email.mime.text" in modules
+    assert all(module["cumulative"] >= module["self"] for module in data["modules"])
+    assert json.loads(PROFILER.to_json(limit=5))["modules"][:1] == data["modules"][:1]
+    print(PROFILER.report(limit=5))
@@ -0,0 +1,46 @@
+import time
+
+from main import SingletonRegistry
+
+# Amount of registered resources and how many of them a typical process actually uses
+RESOURCES = 20
+USED = 3
+# Size of every simulated lookup table
+TABLE_SIZE = 200_000
+
+
+def build_table(seed: int) -> dict[int, int]:
+    return {i: i * seed for i in range(TABLE_SIZE)}
+
+
+def make_registry() -> SingletonRegistry:
+    registry = SingletonRegistry()
+    for i in range(RESOURCES):
+        registry.register(f"table_{i}", lambda seed=i: build_table(seed))
+    return registry
+
+
+def time_startup(eager: bool) -> tuple[float, float]:
+    """
+    Measure startup time and time until the used resources are served
+    :param eager: whether to build all resources at startup
+    :return: startup time and total time in seconds
+    """
+    t_start = time.perf_counter()
+    registry = make_registry()
+    if eager:
+        registry.warm()
+    startup_time = time.perf_counter() - t_start
+
+    for i in range(USED):
+        registry.get(f"table_{i}")
+    total_time = time.perf_counter() - t_start
+
+    return startup_time, total_time
+
+
+if __name__ == "__main__":
+    for eager in (True, False):
+        startup_time, total_time = time_startup(eager)
+        name = "eager" if eager else "lazy"
+        print(f"{name:>5}: startup {startup_time:.4f} s, {USED}/{RESOURCES} resources used after {total_time:.4f} s")
@@ -1,9 +1,25 @@
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
 class SingletonMeta(type):
     _instances = {}
+    # Reentrant, so that a singleton can create another singleton in its __init__
+    _lock = threading.RLock()
 
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(SingletonMeta, cls).__call__(*args, **kwargs)
+        # Double-checked locking: once the instance exists it is returned without locking
+        try:
+            return cls._instances[cls]
+        except KeyError:
+            pass
+
+        with cls._lock:
+            if cls not in cls._instances:
+                cls._instances[cls] = super(SingletonMeta, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
 
@@ -13,10 +29,13 @@ class SingletonWithMeta(object, metaclass=SingletonMeta):
 
 class Singleton(object):
     _instance = None
+    _lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
-        if not cls._instance:
-            cls._instance = object.__new__(cls)
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = object.__new__(cls)
         return cls._instance
 
 
@@ -24,6 +43,106 @@ class NotASingleton(object):
     pass
 
 
+class SingletonRegistry(object):
+    """
+    Registry of lazily built shared resources, e.g. connection pools or large lookup tables.
+    Each resource is built once on first access, per-process resources are built again in forked children
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        # Every resource has its own lock, so a slow factory doesn't block access to other resources
+        self._locks = {}
+        self._lock = threading.Lock()
+        _registries.add(self)
+
+    def register(self, name: str, factory: Callable[[], Any], per_process: bool = True) -> None:
+        """
+        Register factory of a resource without building it
+        :param name: resource name
+        :param factory: callable building the resource
+        :param per_process: whether forked children build their own instance instead of inheriting parent's one,
+            required for anything holding sockets, file descriptors or threads
+        :return: None
+        """
+        with self._lock:
+            self._factories[name] = (factory, per_process)
+            self._locks.setdefault(name, threading.Lock())
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """
+        Get resource, building it on first access
+        :param name: resource name
+        :return: resource instance
+        """
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+
+        try:
+            lock = self._locks[name]
+        except KeyError:
+            raise LookupError(f"Resource {name!r} is not registered") from None
+
+        with lock:
+            if name not in self._instances:
+                factory, _ = self._factories[name]
+                self._instances[name] = factory()
+        return self._instances[name]
+
+    __getitem__ = get
+
+    def warm(self, names: list[str] = None) -> None:
+        """
+        Build resources eagerly, e.g. before serving requests
+        :param names: resource names, all registered resources if None
+        :return: None
+        """
+        for name in names if names is not None else list(self._factories):
+            self.get(name)
+
+    def reset(self, name: str = None) -> None:
+        """
+        Drop built instance so that next access builds it again
+        :param name: resource name, all resources if None
+        :return: None
+        """
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+    def _after_fork_in_child(self) -> None:
+        # Locks could be held by parent's threads that don't exist in the child
+        self._lock = threading.Lock()
+        self._locks = {name: threading.Lock() for name in self._factories}
+        # Inherited instances are only dropped, not closed: closing them could break parent's connections
+        for name, (_, per_process) in self._factories.items():
+            if per_process:
+                self._instances.pop(name, None)
+
+
+_registries = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    SingletonMeta._lock = threading.RLock()
+    Singleton._lock = threading.Lock()
+    for registry in list(_registries):
+        registry._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+registry = SingletonRegistry()
+
+
 if __name__ == "__main__":
     assert NotASingleton() is not NotASingleton()
 
@@ -34,3 +153,45 @@ if __name__ == "__main__":
     from singleton_mod import singleton_mod
     from singleton_mod import singleton_mod as smd
     assert singleton_mod is smd
+
+    # Concurrent first calls must build a single instance
+    class SlowSingleton(object, metaclass=SingletonMeta):
+        built = 0
+
+        def __init__(self):
+            threading.Event().wait(0.01)
+            SlowSingleton.built += 1
+
+    with ThreadPoolExecutor(8) as executor:
+        instances = list(executor.map(lambda _: SlowSingleton(), range(16)))
+    assert all(instance is instances[0] for instance in instances)
+    assert SlowSingleton.built == 1
+
+    with ThreadPoolExecutor(8) as executor:
+        instances = list(executor.map(lambda _: Singleton(), range(16)))
+    assert all(instance is Singleton() for instance in instances)
+
+    # Registry builds resources lazily, once
+    class Resource(object):
+        def __init__(self):
+            self.pid = os.getpid()
+
+    builds = []
+    registry.register("resource", lambda: builds.append(1) or Resource())
+    registry.register("shared_table", lambda: list(range(1000)), per_process=False)
+    assert builds == []
+    with ThreadPoolExecutor(8) as executor:
+        resources = list(executor.map(lambda _: registry.get("resource"), range(16)))
+    assert all(resource is resources[0] for resource in resources)
+    assert builds == [1]
+    table = registry["shared_table"]
+
+    # Forked child builds its own per-process resources and keeps shared ones
+    if hasattr(os, "fork"):
+        pid = os.fork()
+        if pid == 0:
+            ok = registry.get("resource").pid == os.getpid() and registry.get("shared_table") is table
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert registry.get("resource") is resources[0]
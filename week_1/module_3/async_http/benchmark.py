@@ -0,0 +1,435 @@
+import asyncio
+import collections
+import json
+import os
+import random
+import tempfile
+import time
+import unittest.mock
+
+from launcher import merge_shards
+from main import (
+    CLIENT_ERROR,
+    CONNECTION_ERROR,
+    ConcurrencyController,
+    HostScheduler,
+    ResultWriter,
+    ResumeIndex,
+    main,
+)
+from stub_server import StubServer
+
+# Amount of urls fetched by every configuration
+URL_COUNT = 3000
+# Connection limits are lifted so that only the controller and the scheduler limit concurrency
+SESSION_OPTIONS = {"limit": 1000, "limit_per_host": 1000}
+
+CONTROLLERS = {
+    "fixed 10": lambda: ConcurrencyController.fixed(10),
+    "fixed 100": lambda: ConcurrencyController.fixed(100),
+    "fixed 400": lambda: ConcurrencyController.fixed(400),
+    "adaptive": lambda: ConcurrencyController(initial=10, maximum=400),
+}
+
+
+def unlimited() -> HostScheduler:
+    return HostScheduler(max_per_host=1000, rate=None)
+
+
+def count_failed(fp: str) -> int:
+    """
+    Count and remove results
+    :param fp: filepath of results
+    :return: amount of failed urls
+    """
+    with open(fp) as f:
+        statuses = collections.Counter(json.loads(line)["status_code"] for line in f)
+    os.truncate(fp, 0)
+
+    # Stub answers 2xx only, anything else is an overload error or a timeout
+    return sum(count for status, count in statuses.items() if status not in range(200, 300))
+
+
+async def run(name: str, fp: str) -> None:
+    async with StubServer(latency=0.02, jitter=0.005, capacity=50, backlog=50) as server:
+        urls = [f"{server.url}/status/{200 + i % 100}" for i in range(URL_COUNT)]
+        controller = CONTROLLERS[name]()
+        stats = await main(urls, fp, controller, resume=False, scheduler=unlimited(), retries=0, **SESSION_OPTIONS)
+
+    failed = count_failed(fp)
+    print(
+        f"{name:>10}: {URL_COUNT / stats['exec_time']:8.0f} urls/s, "
+        f"server rejected {server.rejected:5d}, max served concurrently {server.max_active:4d}, "
+        f"failed {failed:5d}, final concurrency {stats['concurrency']:4d}, "
+        f"limit changes {len(stats['history']) - 1}"
+    )
+
+
+async def bench_slow_host(name: str, fp: str) -> None:
+    """
+    Fetch urls of a fast host mixed with urls of a slow one, with and without per host limit
+    :param name: "no host limit" or "host limit"
+    :param fp: filepath of results
+    :return: None
+    """
+    scheduler = unlimited() if name == "no host limit" else HostScheduler(max_per_host=20, rate=None)
+    async with StubServer(latency=0.01, capacity=1000) as fast, StubServer(slow_latency=1., capacity=1000) as slow:
+        urls = []
+        for i in range(URL_COUNT):
+            urls.append(f"{fast.url}/status/200?i={i}")
+            if i % 10 == 0:
+                urls.append(f"{slow.url}/slow/200?i={i}")
+        t_start = time.perf_counter()
+        stats = await main(urls, fp, ConcurrencyController.fixed(40), False, scheduler, **SESSION_OPTIONS)
+
+    print(
+        f"{name:>14}: fast host done in {fast.finished_at - t_start:6.2f} s, "
+        f"all done in {stats['exec_time']:6.2f} s, failed {count_failed(fp)}"
+    )
+
+
+async def bench_flaky_host(retries: int, fp: str) -> None:
+    async with StubServer(latency=0.01, failure_rate=0.2, capacity=1000) as server:
+        urls = [f"{server.url}/flaky/200?i={i}" for i in range(URL_COUNT)]
+        stats = await main(
+            urls, fp, ConcurrencyController.fixed(40), False, unlimited(), retries, **SESSION_OPTIONS
+        )
+
+    print(
+        f"{retries:>2} retries: failed {count_failed(fp):4d} of {URL_COUNT}, "
+        f"{stats['scheduler']['retries']:4d} retries, {stats['exec_time']:6.2f} s"
+    )
+
+
+async def bench_tail_latency(hedge: bool, fp: str) -> None:
+    async with StubServer(latency=0.01, slow_latency=0.5, tail_rate=0.02, capacity=1000) as server:
+        urls = [f"{server.url}/tail/200?i={i}" for i in range(URL_COUNT)]
+        stats = await main(
+            urls, fp, ConcurrencyController.fixed(20), False, unlimited(), 0, hedge, **SESSION_OPTIONS
+        )
+
+    count_failed(fp)
+    print(
+        f"{'hedged' if hedge else 'not hedged':>10}: {URL_COUNT / stats['exec_time']:6.0f} urls/s, "
+        f"{stats['scheduler']['hedges']} hedged requests"
+    )
+
+
+async def bench_tracing(trace: bool, fp: str) -> None:
+    async with StubServer(latency=0.005, capacity=1000) as server:
+        urls = [f"{server.url}/status/200?i={i}" for i in range(URL_COUNT)]
+        stats = await main(
+            urls, fp, ConcurrencyController.fixed(50), False, unlimited(), 0, trace=trace, **SESSION_OPTIONS
+        )
+
+    count_failed(fp)
+    print(f"{'traced' if trace else 'not traced':>10}: {URL_COUNT / stats['exec_time']:6.0f} urls/s")
+
+
+async def bench_probe(name: str, fp: str, validators: str) -> None:
+    """
+    Crawl pages of a host supporting HEAD and of a host rejecting it
+    :param name: "GET", "probe" or "probe + validators", the last one is run twice to recrawl
+    :param fp: filepath of results
+    :param validators: filepath of validator cache
+    :return: None
+    """
+    options = {"probe": name != "GET", "validators": validators if name == "probe + validators" else None}
+    for crawl in range(2 if options["validators"] else 1):
+        async with StubServer(latency=0.01, body_size=100_000, capacity=1000, port=18080) as head, \
+                StubServer(latency=0.01, body_size=100_000, capacity=1000, port=18081) as no_head:
+            urls = []
+            for i in range(URL_COUNT // 2):
+                urls += [f"{head.url}/page/200?i={i}", f"{no_head.url}/nohead/200?i={i}"]
+            stats = await main(
+                urls, fp, ConcurrencyController.fixed(50), False, unlimited(), 0, **options, **SESSION_OPTIONS
+            )
+
+        count_failed(fp)
+        print(
+            f"{name + (' recrawl' if crawl else ''):>26}: {URL_COUNT / stats['exec_time']:6.0f} urls/s, "
+            f"{(head.bytes_sent + no_head.bytes_sent) / 2 ** 20:8.2f} MiB of bodies sent, "
+            f"{(stats['prober'] or {}).get('unchanged', 0)} unchanged"
+        )
+
+
+def read_results(fp: str) -> dict:
+    """
+    Read and remove results
+    :param fp: filepath of results
+    :return: dict {url: result}
+    """
+    with open(fp) as f:
+        results = [json.loads(line) for line in f]
+    os.truncate(fp, 0)
+    return {result["url"]: result for result in results}
+
+
+async def check_scheduler(fp: str) -> None:
+    """
+    Checks of HostScheduler, retries and hedging against slow, flaky and broken endpoints
+    :param fp: filepath of results
+    :return: None
+    """
+    # Per host cap holds for every host while all urls are fetched
+    async with StubServer(latency=0.02, capacity=1000) as first, StubServer(latency=0.02, capacity=1000) as second:
+        urls = [f"{server.url}/status/200?i={i}" for i in range(100) for server in (first, second)]
+        scheduler = HostScheduler(max_per_host=3, rate=None)
+        await main(urls, fp, ConcurrencyController.fixed(50), False, scheduler, trace=False)
+    results = read_results(fp)
+    assert first.max_active <= 3 and second.max_active <= 3
+    assert sorted(results) == sorted(urls) and all(result["status_code"] == 200 for result in results.values())
+    assert scheduler.unfinished == 0 and scheduler.hosts == {}
+
+    # Every 503 of a flaky endpoint is either retried or is the final status after the last attempt
+    for retries in [0, 6]:
+        async with StubServer(latency=0.001, failure_rate=0.2, capacity=1000) as server:
+            urls = [f"{server.url}/flaky/200?i={i}" for i in range(300)]
+            stats = await main(urls, fp, ConcurrencyController.fixed(50), False, unlimited(), retries, trace=False)
+        results = read_results(fp)
+        assert sorted(results) == sorted(urls)
+        assert {result["status_code"] for result in results.values()} <= {200, 503}
+        final_failures = sum(result["status_code"] == 503 for result in results.values())
+        assert stats["scheduler"]["retries"] == sum(result.get("attempts", 1) - 1 for result in results.values())
+        assert server.failed == stats["scheduler"]["retries"] + final_failures
+        assert all(result.get("attempts", 1) <= retries + 1 for result in results.values())
+        if retries:
+            # Probability of a url failing 7 times in a row is 0.2 ** 7
+            assert final_failures == 0 and stats["scheduler"]["retries"] > 0
+        else:
+            assert final_failures > 0 and stats["scheduler"]["retries"] == 0
+
+    # Hedges are sent only for the slow tail and stay within the budget
+    async with StubServer(latency=0.005, slow_latency=0.3, tail_rate=0.1, capacity=1000) as server:
+        urls = [f"{server.url}/tail/200?i={i}" for i in range(400)]
+        scheduler = HostScheduler(max_per_host=1000, rate=None, hedge_budget=0.05)
+        stats = await main(urls, fp, ConcurrencyController.fixed(20), False, scheduler, 0, True, trace=False)
+    results = read_results(fp)
+    assert sorted(results) == sorted(urls) and all(result["status_code"] == 200 for result in results.values())
+    hedges = stats["scheduler"]["hedges"]
+    assert 0 < hedges <= 0.05 * stats["scheduler"]["requests"] + 1
+    assert stats["scheduler"]["requests"] == len(urls)
+    assert len(urls) <= server.requests <= len(urls) + hedges
+    assert scheduler.unfinished == 0
+
+    # Failing urls finish with failure statuses and don't block the others
+    # Port of a closed server refuses connections
+    async with StubServer() as closed:
+        pass
+    async with StubServer(latency=0.001) as server:
+        good = [f"{server.url}/status/200?i={i}" for i in range(20)]
+        urls = good + [f"{server.url}/loop/200", f"{closed.url}/status/200", "http://"]
+        scheduler = HostScheduler(rate=None)
+        await asyncio.wait_for(
+            main(urls, fp, ConcurrencyController.fixed(10), False, scheduler, 1, trace=False), timeout=15
+        )
+    results = read_results(fp)
+    assert sorted(results) == sorted(urls)
+    assert all(results[url]["status_code"] == 200 for url in good)
+    assert results[f"{server.url}/loop/200"]["status_code"] == CLIENT_ERROR
+    assert results[f"{closed.url}/status/200"]["status_code"] == CONNECTION_ERROR
+    assert results[f"{closed.url}/status/200"]["attempts"] == 2
+    assert results["http://"]["status_code"] not in range(200, 600)
+    assert scheduler.unfinished == 0
+
+
+async def check_controller(fp: str) -> None:
+    """
+    Checks that adaptive concurrency is lowered by overload only, not by error statuses being crawled
+    :param fp: filepath of results
+    :return: None
+    """
+    async with StubServer(latency=0.02, capacity=1000, backlog=1000) as server:
+        # Same mix of statuses as the default urls, but without overload signals of the stub itself
+        statuses = [status for status in range(200, 600) if status not in (429, 503)]
+        urls = [f"{server.url}/status/{statuses[i % len(statuses)]}?i={i}" for i in range(URL_COUNT)]
+        random.Random(0).shuffle(urls)
+        controller = ConcurrencyController(initial=10, maximum=400)
+        stats = await main(urls, fp, controller, False, unlimited(), 0, trace=False, **SESSION_OPTIONS)
+    results = read_results(fp)
+    assert len(results) == len(urls) and server.rejected == 0
+    assert stats["concurrency"] > 10, stats["concurrency"]
+
+
+async def check_resume(fp: str) -> None:
+    """
+    Checks of ResumeIndex recovery: torn last line, checkpoint with results appended after it,
+    replaced results file and a different capacity, and a resumed crawl skipping fetched urls
+    :param fp: filepath of results
+    :return: None
+    """
+    def write_lines(urls: list[str], tail: bytes = b"", mode: str = "ab") -> None:
+        with open(fp, mode) as f:
+            for url in urls:
+                f.write(json.dumps({"url": url, "status_code": 200}).encode() + b"\n")
+            f.write(tail)
+
+    # A line cut by a crash is removed and its url is fetched again
+    write_lines(["a", "b", "c"], b'{"url": "d", "sta', "wb")
+    full_size = os.path.getsize(fp) - len(b'{"url": "d", "sta')
+    index = ResumeIndex(fp, 1000)
+    index.load()
+    assert (index.count, index.offset, os.path.getsize(fp)) == (3, full_size, full_size)
+    assert all(url in index for url in "abc") and "d" not in index
+
+    # Only results written after the checkpoint are read
+    index.save(full_size)
+    write_lines(["d", "e"])
+    index = ResumeIndex(fp, 1000)
+    index.load()
+    assert index.count == 5 and index.offset == os.path.getsize(fp)
+    assert all(url in index for url in "abcde")
+    assert os.path.getsize(fp + ".bloom") < 10_000
+
+    # Checkpoint of a replaced results file or of another capacity is ignored, the index is rebuilt
+    index.save(os.path.getsize(fp))
+    write_lines(["x"], mode="wb")
+    index = ResumeIndex(fp, 1000)
+    index.load()
+    assert index.count == 1 and "x" in index and "a" not in index
+    index.save(os.path.getsize(fp))
+    index = ResumeIndex(fp, 2000)
+    index.load()
+    assert index.count == 1 and "x" in index
+    for path in [fp, fp + ".bloom", fp + ".checkpoint"]:
+        os.remove(path)
+
+    # Resume is opt-in, a resumed crawl skips urls of the previous one
+    async with StubServer(latency=0.001) as server:
+        urls = [f"{server.url}/status/200?i={i}" for i in range(50)]
+        await main(urls[:30], fp, ConcurrencyController.fixed(10), trace=False)
+        assert not os.path.exists(fp + ".bloom")
+        stats = await main(urls, fp, ConcurrencyController.fixed(10), True, trace=False, resume_capacity=1000)
+    assert stats["skipped"] == 30 and stats["writer"]["lines"] == 20
+    assert sorted(read_results(fp)) == sorted(urls)
+
+
+def check_merge(fp: str) -> None:
+    """
+    Checks that merging shard files is idempotent when interrupted at every step
+    :param fp: filepath of merged results
+    :return: None
+    """
+    def write(path: str, data: bytes) -> None:
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def read() -> bytes:
+        with open(fp, "rb") as f:
+            return f.read()
+
+    def leftovers() -> list[str]:
+        name = os.path.basename(fp)
+        return sorted(path[len(name):] for path in os.listdir(os.path.dirname(fp)) if path.startswith(name + "."))
+
+    def crash(name: str, suffix: str):
+        # Raises instead of calling os.remove or os.rename of a path ending with suffix, as if the process died
+        call = getattr(os, name)
+
+        def interrupted(path, *args):
+            if path.endswith(suffix):
+                raise KeyboardInterrupt
+            return call(path, *args)
+        return unittest.mock.patch(f"os.{name}", interrupted)
+
+    # Complete lines are appended in shard order, a line cut by a crash is dropped, shards are removed
+    write(fp, b"a\n")
+    write(fp + ".shard-0", b"b\nc\npart")
+    write(fp + ".shard-1", b"d\n")
+    write(fp + ".shard-2", b"no newline")
+    with unittest.mock.patch("launcher.COPY_CHUNK_SIZE", 3):
+        assert merge_shards(fp) == 6
+    assert read() == b"a\nb\nc\nd\n" and leftovers() == []
+    assert merge_shards(fp) == 0 and read() == b"a\nb\nc\nd\n"
+
+    # Crash after appending but before the merge is committed: appended lines are truncated and merged again
+    write(fp + ".shard-0", b"e\n")
+    with crash("remove", ".merge"):
+        try:
+            merge_shards(fp)
+        except KeyboardInterrupt:
+            pass
+    assert read() == b"a\nb\nc\nd\ne\n" and leftovers() == [".merge", ".shard-0.merging"]
+    assert merge_shards(fp) == 2 and read() == b"a\nb\nc\nd\ne\n" and leftovers() == []
+
+    # Crash after the commit: merged shards are only removed, new shards are merged
+    write(fp + ".shard-0", b"f\n")
+    write(fp + ".shard-1", b"g\n")
+    with crash("remove", ".merging"):
+        try:
+            merge_shards(fp)
+        except KeyboardInterrupt:
+            pass
+    assert leftovers() == [".shard-0.merging", ".shard-1.merging"]
+    write(fp + ".shard-0", b"h\n")
+    assert merge_shards(fp) == 2 and read() == b"a\nb\nc\nd\ne\nf\ng\nh\n" and leftovers() == []
+
+    # Crash while renaming shards: renamed and remaining shards are merged once
+    write(fp + ".shard-0", b"i\n")
+    write(fp + ".shard-1", b"j\n")
+    with crash("rename", ".shard-1"):
+        try:
+            merge_shards(fp)
+        except KeyboardInterrupt:
+            pass
+    assert leftovers() == [".merge", ".shard-0.merging", ".shard-1"]
+    assert merge_shards(fp) == 4 and read().endswith(b"h\ni\nj\n") and leftovers() == []
+    os.remove(fp)
+
+
+async def write_per_line(input_queue: asyncio.Queue, outfile) -> None:
+    # Previous writer: blocking json.dump of every line on the event loop
+    while (line := await input_queue.get()) is not None:
+        outfile.write(json.dumps(line).encode() + b"\n")
+
+
+async def bench_writer(name: str, fp: str, count: int = 200_000) -> None:
+    """
+    Push results through a writer while measuring the longest event loop stall
+    :param name: "per line" or "batched"
+    :param fp: filepath of results
+    :param count: amount of results
+    :return: None
+    """
+    stalls = []
+
+    async def ticker():
+        while True:
+            t_start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - t_start - 0.001)
+
+    queue = asyncio.Queue(10_000)
+    ticker_task = asyncio.create_task(ticker())
+    t_start = time.perf_counter()
+    with open(fp, "wb") as f:
+        writer = asyncio.create_task(write_per_line(queue, f) if name == "per line" else ResultWriter(f).run(queue))
+        for i in range(count):
+            await queue.put({"url": f"http://127.0.0.1/status/{200 + i % 100}", "status_code": 200 + i % 100})
+        await queue.put(None)
+        await writer
+    all_time = time.perf_counter() - t_start
+    ticker_task.cancel()
+    print(f"{name:>10}: {count / all_time:10.0f} lines/s, max event loop stall {max(stalls) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(check_scheduler(os.path.join(tmp, "results.jsonl")))
+        asyncio.run(check_controller(os.path.join(tmp, "results.jsonl")))
+        asyncio.run(check_resume(os.path.join(tmp, "resume.jsonl")))
+        check_merge(os.path.join(tmp, "merged.jsonl"))
+        for name in CONTROLLERS:
+            asyncio.run(run(name, os.path.join(tmp, "results.jsonl")))
+        for name in ["per line", "batched"]:
+            asyncio.run(bench_writer(name, os.path.join(tmp, "results.jsonl")))
+        for name in ["no host limit", "host limit"]:
+            asyncio.run(bench_slow_host(name, os.path.join(tmp, "results.jsonl")))
+        for retries in [0, 3]:
+            asyncio.run(bench_flaky_host(retries, os.path.join(tmp, "results.jsonl")))
+        for hedge in [False, True]:
+            asyncio.run(bench_tail_latency(hedge, os.path.join(tmp, "results.jsonl")))
+        for trace in [False, True, False, True]:
+            asyncio.run(bench_tracing(trace, os.path.join(tmp, "results.jsonl")))
+        for name in ["GET", "probe", "probe + validators"]:
+            asyncio.run(bench_probe(name, os.path.join(tmp, "results.jsonl"), os.path.join(tmp, "validators.sqlite")))
@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+import zlib
+from typing import Iterable, Iterator
+
+from main import (
+    HOST_CONCURRENCY,
+    HOST_RATE,
+    MAX_RETRIES,
+    RESUME_CAPACITY,
+    URLS,
+    HostScheduler,
+    RequestTracer,
+    ResumeIndex,
+    ValidatorCache,
+    get_host,
+    main,
+    read_urls,
+)
+
+# Amount of urls sent to a shard process at once
+ROUTE_BATCH_SIZE = 1000
+# Max amount of batches waiting for every shard, routing waits while it is reached
+SHARD_QUEUE_SIZE = 16
+# Seconds between liveness checks of shard processes while routing waits
+LIVENESS_INTERVAL = 1.
+# Bytes read from a shard file at once while merging
+COPY_CHUNK_SIZE = 1 << 20
+# Suffix of shard files being merged
+MERGING_SUFFIX = ".merging"
+# Suffix of the file holding size of results file before an unfinished merge
+MERGE_MARKER_SUFFIX = ".merge"
+# Counters summed over shards
+SUMMED_STATS = {
+    "writer": ["lines", "bytes_written", "batches"],
+    "scheduler": ["requests", "retries", "hedges"],
+    "prober": ["heads", "gets", "unchanged"],
+}
+
+
+def shard_of(url: str, shards: int) -> int:
+    """
+    Stable shard of url by its host, so that per host limits stay within one process and restarts
+    send the same hosts to the same shards
+    :param url: string url address
+    :param shards: amount of shards
+    :return: shard number
+    """
+    return zlib.crc32(get_host(url).encode()) % shards
+
+
+def shard_path(fp: str, shard: int) -> str:
+    return f"{fp}.shard-{shard}"
+
+
+def receive_urls(input_queue: multiprocessing.Queue) -> Iterator[str]:
+    while True:
+        batch = input_queue.get()
+        if batch is None:
+            break
+        yield from batch
+
+
+def run_shard(
+    shard: int,
+    input_queue: multiprocessing.Queue,
+    output_queue: multiprocessing.Queue,
+    fp: str,
+    scheduler_options: dict,
+    options: dict,
+) -> None:
+    """
+    Crawl urls routed to the shard with its own event loop and session, results go to the shard file
+    :param shard: shard number
+    :param input_queue: multiprocessing.Queue with batches of urls and None at the end
+    :param output_queue: multiprocessing.Queue for (shard, stats of main)
+    :param fp: filepath of merged results
+    :param scheduler_options: keyword arguments of HostScheduler
+    :param options: keyword arguments of main
+    :return: None
+    """
+    options = {**options, "scheduler": HostScheduler(**scheduler_options)}
+    # Urls are already filtered by the launcher index, shard files are merged after every run
+    stats = asyncio.run(main(receive_urls(input_queue), shard_path(fp, shard), resume=False, **options))
+    output_queue.put((shard, stats))
+
+
+def copy_lines(infile, outfile) -> int:
+    """
+    Stream complete lines of infile to outfile in chunks, a line cut by a crash is dropped and its url fetched again
+    :param infile: binary file to copy from
+    :param outfile: binary file to append to
+    :return: amount of copied bytes
+    """
+    end = infile.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - COPY_CHUNK_SIZE)
+        infile.seek(start)
+        newline = infile.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            end = start + newline + 1
+            break
+        end = start
+
+    infile.seek(0)
+    remaining = end
+    while remaining:
+        chunk = infile.read(min(COPY_CHUNK_SIZE, remaining))
+        outfile.write(chunk)
+        remaining -= len(chunk)
+    return end
+
+
+def write_marker(fp: str, size: int) -> None:
+    with open(fp + ".tmp", "w") as f:
+        f.write(str(size))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(fp + ".tmp", fp)
+    fsync_directory(fp)
+
+
+def fsync_directory(fp: str) -> None:
+    fd = os.open(os.path.dirname(os.path.abspath(fp)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def merge_shards(fp: str) -> int:
+    """
+    Append complete lines of shard files to results file and remove them.
+    Leftovers of an interrupted run are merged the same way before the next run.
+    Merge is idempotent: shard files are renamed to .merging after the size of results file is recorded
+    in a marker file, and the marker is removed once the appended lines are on disk. A merge interrupted
+    before that is undone by truncating results file to the recorded size and done again,
+    .merging files left without a marker are already merged and only removed
+    :param fp: filepath of merged results
+    :return: amount of merged bytes
+    """
+    directory, name = os.path.split(os.path.abspath(fp))
+    marker = fp + MERGE_MARKER_SUFFIX
+    shard_names = sorted(shard_name for shard_name in os.listdir(directory) if shard_name.startswith(name + ".shard-"))
+    with open(fp, "ab") as outfile:
+        if os.path.exists(marker):
+            with open(marker) as f:
+                outfile.truncate(int(f.read()))
+        else:
+            for shard_name in shard_names:
+                if shard_name.endswith(MERGING_SUFFIX):
+                    os.remove(os.path.join(directory, shard_name))
+            shard_names = [shard_name for shard_name in shard_names if not shard_name.endswith(MERGING_SUFFIX)]
+            if not shard_names:
+                return 0
+            write_marker(marker, outfile.tell())
+
+    merging = []
+    for shard_name in shard_names:
+        if shard_name.endswith(MERGING_SUFFIX):
+            shard_name = shard_name[:-len(MERGING_SUFFIX)]
+        else:
+            os.rename(os.path.join(directory, shard_name), os.path.join(directory, shard_name + MERGING_SUFFIX))
+        merging.append(shard_name)
+
+    merged = 0
+    with open(fp, "ab") as outfile:
+        for shard_name in sorted(merging):
+            with open(os.path.join(directory, shard_name + MERGING_SUFFIX), "rb") as infile:
+                merged += copy_lines(infile, outfile)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    # Merge is committed once the marker is gone, leftovers are removed by the next merge if this one crashes
+    os.remove(marker)
+    fsync_directory(marker)
+    for shard_name in merging:
+        os.remove(os.path.join(directory, shard_name + MERGING_SUFFIX))
+    return merged
+
+
+def put_batch(input_queue: multiprocessing.Queue, batch: list[str], process: multiprocessing.Process) -> None:
+    while True:
+        try:
+            input_queue.put(batch, timeout=LIVENESS_INTERVAL)
+            return
+        except queue.Full:
+            if not process.is_alive():
+                raise RuntimeError(f"Shard process {process.name} exited with code {process.exitcode}")
+
+
+def get_result(output_queue: multiprocessing.Queue, processes: list[multiprocessing.Process]) -> tuple[int, dict]:
+    while True:
+        try:
+            return output_queue.get(timeout=LIVENESS_INTERVAL)
+        except queue.Empty:
+            for process in processes:
+                if process.exitcode:
+                    raise RuntimeError(f"Shard process {process.name} exited with code {process.exitcode}")
+
+
+def aggregate(results: list[dict]) -> dict:
+    """
+    Central crawl stats from stats of every shard
+    :param results: list of main() stats
+    :return: dict with summed counters, per shard execution times and merged latency percentiles
+    """
+    stats = {group: {name: 0 for name in names} for group, names in SUMMED_STATS.items()}
+    tracer = RequestTracer()
+    for result in results:
+        for group, names in SUMMED_STATS.items():
+            for name in names:
+                stats[group][name] += (result[group] or {}).get(name, 0)
+        if result["tracer"] is not None:
+            tracer.merge(result["tracer"])
+
+    stats["shard_exec_time"] = [result["exec_time"] for result in results]
+    stats["latency"] = tracer.summary()
+    stats["tracer"] = tracer
+    return stats
+
+
+def launch(
+    urls: Iterable[str] = URLS,
+    fp: str = "results.jsonl",
+    shards: int = None,
+    resume: bool = False,
+    scheduler_options: dict = None,
+    resume_capacity: int = RESUME_CAPACITY,
+    **options,
+) -> dict:
+    """
+    Shard urls by host across processes, each running main with its own event loop and session,
+    and merge per shard results into a single file
+    :param urls: iterable of string url addresses
+    :param fp: filepath of merged results
+    :param shards: amount of processes, CPU count if None
+    :param resume: whether to skip urls already in results file
+    :param scheduler_options: keyword arguments of HostScheduler of every shard, e.g. max_per_host and rate
+    :param resume_capacity: expected amount of urls in results file, sizes the index used to resume
+    :param options: keyword arguments of main, e.g. retries, hedge, probe, validators
+    :return: dict with aggregated stats of all shards
+    """
+    shards = shards or os.cpu_count()
+    t_start = time.perf_counter()
+    merge_shards(fp)
+    if options.get("validators"):
+        # All shards share one validators database, so a recrawl with another amount of shards keeps conditional
+        # requests. It is created here, as switching to WAL journal at once from every shard could fail
+        ValidatorCache(options["validators"]).close()
+
+    index = None
+    if resume:
+        index = ResumeIndex(fp, resume_capacity)
+        index.load()
+        index.save(os.path.getsize(fp))
+        print(f"Resuming after {index.count} fetched urls")
+
+    output_queue = multiprocessing.Queue()
+    input_queues = [multiprocessing.Queue(SHARD_QUEUE_SIZE) for _ in range(shards)]
+    processes = [
+        multiprocessing.Process(
+            target=run_shard,
+            args=(shard, input_queues[shard], output_queue, fp, scheduler_options or {}, options),
+            name=f"shard-{shard}",
+        )
+        for shard in range(shards)
+    ]
+    for process in processes:
+        process.start()
+
+    skipped = 0
+    try:
+        batches = [[] for _ in range(shards)]
+        for url in urls:
+            if index is not None and url in index:
+                skipped += 1
+                continue
+            shard = shard_of(url, shards)
+            batches[shard].append(url)
+            if len(batches[shard]) >= ROUTE_BATCH_SIZE:
+                put_batch(input_queues[shard], batches[shard], processes[shard])
+                batches[shard] = []
+
+        for shard, batch in enumerate(batches):
+            if batch:
+                put_batch(input_queues[shard], batch, processes[shard])
+            put_batch(input_queues[shard], None, processes[shard])
+
+        # Stats are received before joining, a process doesn't exit until its queue is drained
+        results = [None] * shards
+        for _ in range(shards):
+            shard, result = get_result(output_queue, processes)
+            results[shard] = result
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    merge_shards(fp)
+    stats = aggregate(results)
+    stats["skipped"] = skipped
+    stats["exec_time"] = time.perf_counter() - t_start
+    print(
+        f"All {shards} shards done in {stats['exec_time']} seconds, {stats['writer']['lines']} urls fetched, "
+        f"{skipped} skipped"
+    )
+    print(stats["tracer"].report())
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch status codes of urls in several processes")
+    parser.add_argument("input", nargs="?", help="file with a url per line, - for stdin, built-in urls if omitted")
+    parser.add_argument("--output", default="results.jsonl")
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--resume", action="store_true", help="skip urls already in output")
+    parser.add_argument(
+        "--resume-capacity", type=int, default=RESUME_CAPACITY, help="expected amount of urls in output for --resume"
+    )
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--hedge", action="store_true", help="send duplicate request when response is slow")
+    parser.add_argument("--probe", action="store_true", help="send HEAD, or GET of the first byte, instead of GET")
+    parser.add_argument("--validators", help="SQLite file of ETag/Last-Modified for conditional requests")
+    parser.add_argument("--host-concurrency", type=int, default=HOST_CONCURRENCY, help="requests in flight per host")
+    parser.add_argument("--host-rate", type=float, default=HOST_RATE, help="requests per second per host")
+    cli_options = parser.parse_args()
+
+    launch(
+        read_urls(cli_options.input) if cli_options.input else URLS,
+        cli_options.output,
+        cli_options.shards,
+        cli_options.resume,
+        {"max_per_host": cli_options.host_concurrency, "rate": cli_options.host_rate},
+        cli_options.resume_capacity,
+        retries=cli_options.retries,
+        hedge=cli_options.hedge,
+        probe=cli_options.probe,
+        validators=cli_options.validators,
+    )
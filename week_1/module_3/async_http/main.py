@@ -1,10 +1,93 @@
+import argparse
 import asyncio
+import collections
+import hashlib
+import itertools
+import math
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import threading
 import time
 import aiohttp
 import json
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urlsplit
 
-# Number of high level coroutines to start concurrently
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Initial amount of requests in flight, adjusted at runtime by ConcurrencyController
 NUMBER_OF_WORKERS = 10
+# Bounds of adaptive concurrency
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 500
+# Limits of open connections, total and per host
+CONNECTION_LIMIT = 500
+CONNECTION_LIMIT_PER_HOST = 100
+# Seconds to cache resolved host addresses
+DNS_CACHE_TTL = 300
+# Seconds to keep idle connections open for reuse
+KEEPALIVE_TIMEOUT = 30
+# Seconds for whole request, connection setup and every socket read
+TOTAL_TIMEOUT = 30
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+# Window latency above best recent window latency multiplied by this is treated as congestion
+LATENCY_TOLERANCE = 2.0
+# Error rate of a window above this is treated as congestion
+MAX_ERROR_RATE = 0.05
+# Amount of recent windows to take the best latency from
+BASELINE_WINDOWS = 10
+# Results are written once this many lines are buffered or buffer is this many seconds old
+WRITE_BATCH_SIZE = 1000
+WRITE_FLUSH_INTERVAL = 1.
+# Politeness limits for every host: requests in flight, requests per second and burst of the token bucket
+HOST_CONCURRENCY = 8
+HOST_RATE = 50.
+HOST_BURST = 10
+# Retries of transient failures, delay before retry is random up to min(cap, base * 2 ** attempt) seconds
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 10.
+# Hedged request is sent once the first one is slower than this quantile of recent latencies of the host
+HEDGE_QUANTILE = 0.95
+# Min amount of latency samples of a host to hedge its requests and the amount of samples kept
+HEDGE_MIN_SAMPLES = 20
+LATENCY_SAMPLES = 200
+# Max amount of hosts with latency samples kept, least recently used hosts are forgotten
+LATENCY_HOSTS = 10_000
+# Max share of hedged requests among all requests
+HEDGE_BUDGET = 0.05
+# Histogram precision: values above 2 ** HISTOGRAM_SUB_BUCKET_BITS are kept with 2 ** (HISTOGRAM_SUB_BUCKET_BITS - 1)
+# buckets per power of two, 64 for 7 bits, so a bucket middle is within 0.78% of any value in it
+HISTOGRAM_SUB_BUCKET_BITS = 7
+# Max amount of hosts with latency histograms, least recently used hosts are forgotten
+TRACE_HOSTS = 1000
+# Responses to HEAD meaning the server doesn't support it, url is probed with ranged GET then
+HEAD_REJECTED_STATUSES = {405, 501}
+# Max amount of hosts remembered as rejecting HEAD
+HEAD_REJECTED_HOSTS = 10_000
+# Amount of new validators written to ValidatorCache at once
+VALIDATOR_BATCH_SIZE = 1000
+# Seconds a ValidatorCache connection waits for a lock held by another process sharing the database
+VALIDATOR_BUSY_TIMEOUT = 60.
+# Max amount of urls looked up in ValidatorCache by a single query, below SQLite limit of query parameters
+VALIDATOR_LOOKUP_SIZE = 500
+# Size of url and result queues, keeps memory constant for any amount of urls
+QUEUE_SIZE = 10_000
+# Amount of urls read from input at once
+READ_BATCH_SIZE = 1000
+# Seconds between checkpoints of ResumeIndex
+CHECKPOINT_INTERVAL = 30.
+# Default expected amount of urls and acceptable probability to skip a url that wasn't fetched on resume,
+# the index takes about 3.6 MB per million urls
+RESUME_CAPACITY = 1_000_000
+RESUME_ERROR_RATE = 1e-6
 
 # URLS = [
 #     "https://example.com",
@@ -16,97 +99,1454 @@ NUMBER_OF_WORKERS = 10
 # ]
 URLS = [f"https://httpbin.org/status/{code}" for code in range(200, 600)]
 
+# Status codes returned by fetch instead of HTTP status when request fails
+CONNECTION_ERROR = 0
+TIMEOUT = 1
+INVALID_URL = 2
+CONTENT_TYPE_ERROR = 3
+# Any other client error, e.g. too many redirects or a broken response body
+CLIENT_ERROR = 4
+# Response to a conditional request for an unchanged url
+NOT_MODIFIED = 304
+# Failures worth retrying
+TRANSIENT_STATUSES = {CONNECTION_ERROR, TIMEOUT, 429, 502, 503, 504}
+# Failures meaning the target is overloaded, other statuses are results of the crawl and don't lower concurrency
+OVERLOAD_STATUSES = {CONNECTION_ERROR, TIMEOUT, 429, 503}
+
 
-async def fetch(url: str, session: aiohttp.ClientSession) -> int:
+async def fetch(
+    url: str,
+    session: aiohttp.ClientSession,
+    trace: dict = None,
+    prober: "Prober" = None,
+    headers: dict = None,
+) -> int:
     """
     Fetch single url using session
     :param url: string url address
     :param session: aiohttp.ClientSession object
+    :param trace: dict filled with phase durations by RequestTracer hooks of the session
+    :param prober: Prober object to get status without downloading the body, plain GET if None
+    :param headers: conditional request headers of the url from ValidatorCache.lookup, used by prober
     :return: status code
     """
     try:
-        async with session.get(url) as resp:
+        if prober is not None:
+            return await prober.request(url, session, trace, headers)
+        async with session.get(url, trace_request_ctx=trace) as resp:
             return resp.status
-    except aiohttp.ClientConnectorError:
-        return 0
+    # Timeouts go first, aiohttp.ServerTimeoutError is a connection error too
     except asyncio.TimeoutError:
-        return 1
+        return TIMEOUT
+    except aiohttp.ClientConnectionError:
+        return CONNECTION_ERROR
     except aiohttp.InvalidURL:
-        return 2
+        return INVALID_URL
     except aiohttp.ContentTypeError:
-        return 3
+        return CONTENT_TYPE_ERROR
+    except aiohttp.ClientError:
+        return CLIENT_ERROR
 
 
-async def populate_queue(input_queue: asyncio.Queue, urls: list[str]) -> None:
+class ValidatorCache(object):
     """
-    Populate input queue with values and add None at the end to stop workers
-    :param input_queue: asyncio.Queue for urls
-    :param urls: list of string url addresses to be fetched
-    :return: None
+    On-disk SQLite cache of ETag and Last-Modified of fetched urls for conditional requests on recrawls.
+    Lookups are done for batches of urls as they are read, new validators are written in batches
+    by a second connection; both run in a thread executor and WAL journal lets reads go on during writes.
+    Several processes can share the database, their writes wait for each other up to VALIDATOR_BUSY_TIMEOUT
     """
-    for url in urls:
-        await input_queue.put(url)
 
-    for _ in range(NUMBER_OF_WORKERS):
-        await input_queue.put(None)
+    def __init__(self, fp: str, batch_size: int = VALIDATOR_BATCH_SIZE):
+        """
+        :param fp: filepath of SQLite database
+        :param batch_size: amount of new validators written at once
+        """
+        self.fp = fp
+        self.batch_size = batch_size
+        # Used by one read_batch call at a time, though not always from the same executor thread
+        self.connection = sqlite3.connect(fp, timeout=VALIDATOR_BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS validators (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)"
+        )
+        self.connection.commit()
+        self._writer = sqlite3.connect(fp, timeout=VALIDATOR_BUSY_TIMEOUT, check_same_thread=False)
+        self._writer_lock = threading.Lock()
+        self._pending = []
+
+    def lookup(self, urls: list[str]) -> dict:
+        """
+        Get conditional request headers of many urls, blocking, so it is called in a thread executor
+        :param urls: list of string url addresses
+        :return: dict {url: dict of conditional request headers} for urls having validators
+        """
+        found = {}
+        for i in range(0, len(urls), VALIDATOR_LOOKUP_SIZE):
+            chunk = urls[i:i + VALIDATOR_LOOKUP_SIZE]
+            rows = self.connection.execute(
+                f"SELECT url, etag, last_modified FROM validators WHERE url IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for url, etag, last_modified in rows:
+                headers = {}
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+                found[url] = headers
+        return found
+
+    async def put(self, url: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+        self._pending.append((url, etag, last_modified))
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        rows = self._pending
+        self._pending = []
+        await asyncio.get_running_loop().run_in_executor(None, self._write, rows)
+
+    def _write(self, rows: list[tuple]) -> None:
+        with self._writer_lock:
+            self._writer.executemany("INSERT OR REPLACE INTO validators VALUES (?, ?, ?)", rows)
+            self._writer.commit()
 
+    def close(self) -> None:
+        self.connection.close()
+        self._writer.close()
 
-async def fetch_urls(input_queue: asyncio.Queue, output_queue: asyncio.Queue, session: aiohttp.ClientSession) -> None:
+
+class Prober(object):
     """
-    Start fetching urls from input queue and writing results to output queue
-    :param input_queue: asyncio.Queue populated with urls
-    :param output_queue: asyncio.Queue for fetching results
-    :param session: aiohttp.ClientSession for making requests
-    :return: None
+    Gets status of urls without downloading bodies: sends HEAD, and for hosts rejecting HEAD sends GET
+    of the first byte only, closing the connection if server ignores the range.
+    With ValidatorCache every request is conditional, 304 response means url is unchanged since the last crawl
+    """
+
+    def __init__(self, head: bool = True, cache: ValidatorCache = None):
+        """
+        :param head: whether to try HEAD first, only GET of the first byte is sent if False
+        :param cache: ValidatorCache object, requests aren't conditional if None
+        """
+        self.head = head
+        self.cache = cache
+        # Hosts answered HEAD with one of HEAD_REJECTED_STATUSES, least recently used ones are forgotten
+        self.head_rejected = collections.OrderedDict()
+        self.heads = 0
+        self.gets = 0
+        self.unchanged = 0
+
+    async def request(
+        self,
+        url: str,
+        session: aiohttp.ClientSession,
+        trace: dict = None,
+        headers: dict = None,
+    ) -> int:
+        """
+        Get url status
+        :param url: string url address
+        :param session: aiohttp.ClientSession object
+        :param trace: dict for RequestTracer hooks of the session
+        :param headers: conditional request headers of the url looked up when it was read, none if None
+        :return: status code, 200 for a successful ranged GET
+        """
+        headers = dict(headers) if headers else {}
+        key = get_host(url)
+        if self.head and key not in self.head_rejected:
+            self.heads += 1
+            async with session.head(url, headers=headers, allow_redirects=True, trace_request_ctx=trace) as resp:
+                if resp.status not in HEAD_REJECTED_STATUSES:
+                    return await self._finish(url, resp, resp.status)
+            self.head_rejected[key] = True
+            if len(self.head_rejected) > HEAD_REJECTED_HOSTS:
+                self.head_rejected.popitem(last=False)
+        elif key in self.head_rejected:
+            self.head_rejected.move_to_end(key)
+
+        self.gets += 1
+        headers["Range"] = "bytes=0-0"
+        async with session.get(url, headers=headers, trace_request_ctx=trace) as resp:
+            status = resp.status
+            if status == 206:
+                # A single byte, reading it keeps the connection reusable
+                await resp.read()
+                status = 200
+            elif status == 416:
+                # Empty body can't satisfy the range, but the resource exists
+                status = 200
+            else:
+                # Server ignored the range, connection is closed instead of downloading the body
+                resp.close()
+            return await self._finish(url, resp, status)
+
+    async def _finish(self, url: str, resp: aiohttp.ClientResponse, status: int) -> int:
+        if status == NOT_MODIFIED:
+            self.unchanged += 1
+        elif self.cache is not None and status == 200:
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if etag or last_modified:
+                await self.cache.put(url, etag, last_modified)
+        return status
+
+    def stats(self) -> dict:
+        return {
+            "heads": self.heads,
+            "gets": self.gets,
+            "unchanged": self.unchanged,
+            "head_rejected_hosts": len(self.head_rejected),
+        }
+
+
+class ConcurrencyController(object):
+    """
+    Limit of requests in flight with additive increase and multiplicative decrease (AIMD).
+    After every window of completed requests (window size equals current limit) the limit grows by one,
+    or is multiplied by decrease_factor if median latency or error rate of the window degraded.
+    Until the first degradation the limit doubles instead of growing by one (slow start)
+    """
+
+    def __init__(
+        self,
+        initial: int = NUMBER_OF_WORKERS,
+        minimum: int = MIN_CONCURRENCY,
+        maximum: int = MAX_CONCURRENCY,
+        latency_tolerance: float = LATENCY_TOLERANCE,
+        max_error_rate: float = MAX_ERROR_RATE,
+        decrease_factor: float = 0.5,
+    ):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.slow_start = True
+        self.in_flight = 0
+        self.latencies = []
+        self.errors = 0
+        # Median latencies of recent windows, the best one is the latency of unloaded server
+        self.baseline = collections.deque(maxlen=BASELINE_WINDOWS)
+        # (timestamp, limit) for every limit change
+        self.history = [(time.perf_counter(), self.limit)]
+        self._waiters = collections.deque()
+
+    @classmethod
+    def fixed(cls, concurrency: int) -> "ConcurrencyController":
+        return cls(concurrency, concurrency, concurrency)
+
+    async def acquire(self) -> None:
+        """
+        Wait until amount of requests in flight is below the limit and take a slot
+        :return: None
+        """
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Wake up was already handed to this waiter, pass it on
+                    self._wake_up()
+                else:
+                    self._waiters.remove(waiter)
+                raise
+        self.in_flight += 1
+
+    def release(self, latency: float, error: bool) -> None:
+        """
+        Free a slot and account the completed request
+        :param latency: request duration in seconds
+        :param error: whether request failed
+        :return: None
+        """
+        self.in_flight -= 1
+        self.latencies.append(latency)
+        self.errors += error
+        if len(self.latencies) >= self.limit:
+            self._adjust()
+        self._wake_up()
+
+    def abort(self) -> None:
+        """
+        Free a slot that wasn't used for a request
+        :return: None
+        """
+        self.in_flight -= 1
+        self._wake_up()
+
+    def _adjust(self) -> None:
+        latency = statistics.median(self.latencies)
+        error_rate = self.errors / len(self.latencies)
+        self.latencies = []
+        self.errors = 0
+
+        congested = error_rate > self.max_error_rate or (
+            bool(self.baseline) and latency > min(self.baseline) * self.latency_tolerance
+        )
+        self.baseline.append(latency)
+        if congested:
+            self.slow_start = False
+            limit = max(self.minimum, int(self.limit * self.decrease_factor))
+        elif self.slow_start:
+            limit = min(self.maximum, self.limit * 2)
+        else:
+            limit = min(self.maximum, self.limit + 1)
+        if limit != self.limit:
+            self.limit = limit
+            self.history.append((time.perf_counter(), limit))
+
+    def _wake_up(self) -> None:
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+def is_error(status: int) -> bool:
+    """
+    Whether status is a failure caused by server load or network: connection errors, timeouts, 429 and 503.
+    Other 5xx are answers of a healthy server, e.g. /status/500 of the default urls
+    :param status: status code returned by fetch
+    :return: bool
+    """
+    return status in OVERLOAD_STATUSES
+
+
+def is_transient(status: int) -> bool:
+    return status in TRANSIENT_STATUSES
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter, so that retries of simultaneous failures don't arrive together
+    :param attempt: number of failed attempts before, starting from 0
+    :return: seconds to wait
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def get_host(url: str) -> str:
+    try:
+        return urlsplit(url).netloc
+    except ValueError:
+        return ""
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` requests per second on average and up to `burst` requests at once
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """
+        Refill tokens
+        :param now: time.monotonic() value
+        :return: seconds until a token is available, 0 if it is available now
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0. if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class _Host(object):
+    def __init__(self, bucket: Optional[TokenBucket]):
+        self.pending = collections.deque()
+        self.active = 0
+        self.bucket = bucket
+
+    def ready(self, now: float, max_active: int) -> float:
+        """
+        :return: 0 if a request may be sent now, seconds until a token is available, or inf when at max_active
+        """
+        if self.active >= max_active:
+            return math.inf
+        return self.bucket.delay(now) if self.bucket is not None else 0.
+
+    def start(self) -> None:
+        self.active += 1
+        if self.bucket is not None:
+            self.bucket.take()
+
+
+class HostScheduler(object):
+    """
+    Queue of urls handing them out round-robin across hosts, so that a slow host can't take all workers.
+    Every host has a limit of requests in flight and a token bucket limiting its request rate
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = HOST_CONCURRENCY,
+        rate: Optional[float] = HOST_RATE,
+        burst: int = HOST_BURST,
+        max_pending: int = QUEUE_SIZE,
+        hedge_budget: float = HEDGE_BUDGET,
+    ):
+        """
+        :param max_per_host: max amount of requests in flight to a host
+        :param rate: max requests per second to a host, unlimited if None
+        :param burst: max amount of requests sent to a host at once within the rate
+        :param max_pending: max amount of queued urls, put waits while it is reached
+        :param hedge_budget: max share of hedged requests among all requests
+        """
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.hedge_budget = hedge_budget
+        self.hosts = {}
+        # Host -> recent latencies, kept apart from hosts as idle hosts are dropped
+        self.latencies = collections.OrderedDict()
+        # Hosts with queued urls in round-robin order
+        self.waiting = collections.OrderedDict()
+        self.pending = 0
+        # Urls put and not done yet, including ones being fetched or waiting for a retry
+        self.unfinished = 0
+        self.requests = 0
+        self.hedges = 0
+        self.retries = 0
+        self.closed = False
+        self._changed = asyncio.Event()
+        self._space = asyncio.Event()
+
+    def _get_host(self, key: str) -> _Host:
+        try:
+            return self.hosts[key]
+        except KeyError:
+            bucket = TokenBucket(self.rate, self.burst) if self.rate is not None else None
+            host = self.hosts[key] = _Host(bucket)
+            return host
+
+    def _enqueue(self, url: str, attempt: int, headers: Optional[dict]) -> None:
+        key = get_host(url)
+        host = self._get_host(key)
+        host.pending.append((url, attempt, headers))
+        if key not in self.waiting:
+            self.waiting[key] = host
+        self.pending += 1
+        self._changed.set()
+
+    async def put(self, url: str, headers: dict = None) -> None:
+        """
+        Queue a new url, waiting while max_pending urls are queued
+        :param url: string url address
+        :param headers: conditional request headers of the url, returned by get along with it
+        :return: None
+        """
+        while self.pending >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+        self.unfinished += 1
+        self._enqueue(url, 0, headers)
+
+    def retry(self, url: str, attempt: int, headers: dict = None) -> None:
+        """
+        Queue failed url again, regardless of max_pending so that retries can't deadlock
+        :param url: string url address
+        :param attempt: number of the next attempt
+        :param headers: conditional request headers of the url
+        :return: None
+        """
+        self.retries += 1
+        self._enqueue(url, attempt, headers)
+
+    def close(self) -> None:
+        """
+        Mark that no new urls will be put, get returns None once all urls are done
+        :return: None
+        """
+        self.closed = True
+        self._changed.set()
+
+    async def get(self) -> Optional[tuple[str, int, Optional[dict]]]:
+        """
+        Take url of the next host that has free capacity and a token, a host slot is taken until release
+        :return: tuple (url, attempt, headers) or None when closed and all urls are done
+        """
+        while True:
+            now = time.monotonic()
+            wait = None
+            for key, host in self.waiting.items():
+                delay = host.ready(now, self.max_per_host)
+                if delay:
+                    if delay != math.inf:
+                        wait = delay if wait is None else min(wait, delay)
+                    continue
+
+                item = host.pending.popleft()
+                host.start()
+                # Host goes to the end of round-robin order
+                del self.waiting[key]
+                if host.pending:
+                    self.waiting[key] = host
+                self.pending -= 1
+                self.requests += 1
+                self._space.set()
+                return item
+
+            if self.closed and not self.unfinished:
+                return None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, url: str, latency: float = None) -> None:
+        """
+        Free host slot taken by get or try_hedge
+        :param url: string url address
+        :param latency: request duration in seconds to estimate hedging delay of the host
+        :return: None
+        """
+        key = get_host(url)
+        host = self.hosts[key]
+        host.active -= 1
+        if latency is not None:
+            self._record_latency(key, latency)
+        # Idle hosts are dropped once their bucket is full again, they would get the same state when recreated
+        if not host.active and not host.pending and (
+            host.bucket is None or host.bucket.delay(time.monotonic()) == 0 and host.bucket.tokens >= host.bucket.burst
+        ):
+            del self.hosts[key]
+        self._changed.set()
+
+    def _record_latency(self, key: str, latency: float) -> None:
+        try:
+            latencies = self.latencies[key]
+            self.latencies.move_to_end(key)
+        except KeyError:
+            latencies = self.latencies[key] = collections.deque(maxlen=LATENCY_SAMPLES)
+            if len(self.latencies) > LATENCY_HOSTS:
+                self.latencies.popitem(last=False)
+        latencies.append(latency)
+
+    def done(self) -> None:
+        """
+        Mark url as finished, after its last attempt
+        :return: None
+        """
+        self.unfinished -= 1
+        self._changed.set()
+
+    def hedge_delay(self, url: str) -> Optional[float]:
+        """
+        :param url: string url address
+        :return: seconds after which a request to the url host is considered slow, None if not known yet
+        """
+        latencies = self.latencies.get(get_host(url))
+        if latencies is None or len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * HEDGE_QUANTILE))]
+
+    def try_hedge(self, url: str) -> bool:
+        """
+        Take a host slot for a hedged request if hedge budget and host limits allow it
+        :param url: string url address
+        :return: whether the slot was taken
+        """
+        if self.hedges >= self.hedge_budget * self.requests:
+            return False
+        host = self.hosts[get_host(url)]
+        if host.ready(time.monotonic(), self.max_per_host):
+            return False
+        host.start()
+        self.hedges += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "retries": self.retries, "hedges": self.hedges}
+
+
+def make_session(
+    limit: int = CONNECTION_LIMIT,
+    limit_per_host: int = CONNECTION_LIMIT_PER_HOST,
+    ttl_dns_cache: int = DNS_CACHE_TTL,
+    keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+    timeout: aiohttp.ClientTimeout = None,
+    trace_configs: list[aiohttp.TraceConfig] = None,
+) -> aiohttp.ClientSession:
+    """
+    Create session with pooled keep-alive connections and cached DNS, must be called inside running event loop
+    :param limit: max amount of open connections
+    :param limit_per_host: max amount of open connections to the same host
+    :param ttl_dns_cache: seconds to cache resolved addresses
+    :param keepalive_timeout: seconds to keep idle connections
+    :param timeout: aiohttp.ClientTimeout, total, connect and read timeouts from module constants if None
+    :param trace_configs: list of aiohttp.TraceConfig objects, e.g. from RequestTracer
+    :return: aiohttp.ClientSession object
+    """
+    if timeout is None:
+        timeout = aiohttp.ClientTimeout(total=TOTAL_TIMEOUT, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=ttl_dns_cache,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=trace_configs)
+
+
+class Histogram(object):
+    """
+    HDR-style histogram of durations: counts in buckets of constant relative width, recording is O(1)
+    and memory depends on the range of values only, not on their amount.
+    Durations are kept in microseconds with precision of 2 ** -(HISTOGRAM_SUB_BUCKET_BITS - 1)
+    """
+
+    def __init__(self):
+        self.counts = collections.defaultdict(int)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    @staticmethod
+    def bucket_of(value: int) -> int:
+        if value < 1 << HISTOGRAM_SUB_BUCKET_BITS:
+            return value
+        # Values of every next power of two share the same amount of buckets
+        shift = value.bit_length() - HISTOGRAM_SUB_BUCKET_BITS
+        half = 1 << (HISTOGRAM_SUB_BUCKET_BITS - 1)
+        return (1 << HISTOGRAM_SUB_BUCKET_BITS) + (shift - 1) * half + (value >> shift) - half
+
+    @staticmethod
+    def value_of(bucket: int) -> float:
+        """
+        :param bucket: bucket index
+        :return: middle value of the bucket in microseconds
+        """
+        if bucket < 1 << HISTOGRAM_SUB_BUCKET_BITS:
+            return bucket
+        half = 1 << (HISTOGRAM_SUB_BUCKET_BITS - 1)
+        shift, mantissa = divmod(bucket - (1 << HISTOGRAM_SUB_BUCKET_BITS), half)
+        shift += 1
+        return ((mantissa + half) << shift) + (1 << shift) / 2
+
+    def record(self, seconds: float) -> None:
+        self.counts[self.bucket_of(int(seconds * 1_000_000))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "Histogram") -> None:
+        for bucket, count in other.counts.items():
+            self.counts[bucket] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, quantile: float) -> float:
+        """
+        :param quantile: from 0 to 1
+        :return: duration in seconds
+        """
+        if not self.count:
+            return 0.
+        rank = max(1, math.ceil(quantile * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.value_of(bucket) / 1_000_000, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class RequestTracer(object):
+    """
+    Records durations of request phases with aiohttp TraceConfig hooks into histograms, overall and per host.
+    Phases: queued - waiting for a free connection, dns - resolving host (absent on DNS cache hit),
+    connect - TCP connection including TLS handshake (absent when connection is reused),
+    ttfb - from sending request headers to receiving response headers, total - whole request.
+    Phases are recorded only for requests made with a dict passed as trace_request_ctx
+    """
+
+    PHASES = ("queued", "dns", "connect", "ttfb", "total")
+
+    def __init__(self):
+        self.overall = {phase: Histogram() for phase in self.PHASES}
+        self.hosts = collections.OrderedDict()
+
+    def make_trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_queued_start.append(self._start("queued"))
+        trace_config.on_connection_queued_end.append(self._end("queued"))
+        trace_config.on_dns_resolvehost_start.append(self._start("dns"))
+        trace_config.on_dns_resolvehost_end.append(self._end("dns"))
+        trace_config.on_connection_create_start.append(self._start("connect"))
+        trace_config.on_connection_create_end.append(self._end("connect"))
+        trace_config.on_request_headers_sent.append(self._start("ttfb"))
+        trace_config.on_request_end.append(self._end("ttfb"))
+        return trace_config
+
+    @staticmethod
+    def _start(phase: str):
+        start = phase + "_start"
+
+        async def on_start(session, context, params) -> None:
+            if context.trace_request_ctx is not None:
+                context.trace_request_ctx[start] = time.perf_counter()
+
+        return on_start
+
+    @staticmethod
+    def _end(phase: str):
+        start = phase + "_start"
+
+        async def on_end(session, context, params) -> None:
+            trace = context.trace_request_ctx
+            if trace is not None and start in trace:
+                trace[phase] = time.perf_counter() - trace.pop(start)
+
+        return on_end
+
+    def record(self, url: str, trace: dict) -> None:
+        """
+        Add phase durations of a finished request to histograms
+        :param url: string url address
+        :param trace: dict {phase: seconds}, phases that didn't finish have only their start time recorded
+        :return: None
+        """
+        key = get_host(url)
+        try:
+            host = self.hosts[key]
+            self.hosts.move_to_end(key)
+        except KeyError:
+            host = self.hosts[key] = {phase: Histogram() for phase in self.PHASES}
+            if len(self.hosts) > TRACE_HOSTS:
+                self.hosts.popitem(last=False)
+
+        for phase in self.PHASES:
+            if phase in trace:
+                self.overall[phase].record(trace[phase])
+                host[phase].record(trace[phase])
+
+    def merge(self, other: "RequestTracer") -> None:
+        """
+        Add histograms of another tracer, e.g. of another process
+        :param other: RequestTracer object
+        :return: None
+        """
+        for phase, histogram in other.overall.items():
+            self.overall[phase].merge(histogram)
+        for key, phases in other.hosts.items():
+            host = self.hosts.setdefault(key, {phase: Histogram() for phase in self.PHASES})
+            for phase, histogram in phases.items():
+                host[phase].merge(histogram)
+            if len(self.hosts) > TRACE_HOSTS:
+                self.hosts.popitem(last=False)
+
+    def summary(self, hosts: int = 5) -> dict:
+        """
+        :param hosts: amount of hosts with the slowest p99 total time to include
+        :return: dict with p50/p90/p99 of every phase overall and of the slowest hosts
+        """
+        slowest = sorted(self.hosts, key=lambda key: self.hosts[key]["total"].percentile(0.99), reverse=True)
+        return {
+            "overall": {phase: histogram.summary() for phase, histogram in self.overall.items()},
+            "hosts": {
+                key: {phase: histogram.summary() for phase, histogram in self.hosts[key].items()}
+                for key in slowest[:hosts]
+            },
+        }
+
+    def report(self, hosts: int = 5) -> str:
+        data = self.summary(hosts)
+        lines = [f"{'':>24} {'phase':>8} {'count':>8} {'p50, ms':>10} {'p90, ms':>10} {'p99, ms':>10}"]
+        for name, phases in [("overall", data["overall"]), *data["hosts"].items()]:
+            for phase, item in phases.items():
+                if item["count"]:
+                    lines.append(
+                        f"{name[:24]:>24} {phase:>8} {item['count']:8d} {item['p50'] * 1000:10.2f} "
+                        f"{item['p90'] * 1000:10.2f} {item['p99'] * 1000:10.2f}"
+                    )
+
+        return "\n".join(lines)
+
+
+def read_urls(fp: str) -> Iterator[str]:
+    """
+    Lazily read urls, one per line
+    :param fp: filepath, "-" for stdin
+    :return: iterator of string url addresses
     """
+    with (open(fp) if fp != "-" else sys.stdin) as f:
+        for line in f:
+            url = line.strip()
+            if url:
+                yield url
+
+
+def read_batch(
+    urls: Iterator[str],
+    index: "ResumeIndex" = None,
+    validators: ValidatorCache = None,
+) -> tuple[list[tuple[str, Optional[dict]]], int]:
+    """
+    Read next urls skipping ones already fetched, with their conditional request headers
+    :param urls: iterator of string url addresses
+    :param index: ResumeIndex object of fetched urls, nothing is skipped if None
+    :param validators: ValidatorCache object to look headers up in, headers are None if it is None
+    :return: tuple (list of (url, headers) to fetch, amount of urls read)
+    """
+    lines = list(itertools.islice(urls, READ_BATCH_SIZE))
+    batch = lines if index is None else [url for url in lines if url not in index]
+    found = validators.lookup(batch) if validators is not None else {}
+    return [(url, found.get(url)) for url in batch], len(lines)
+
+
+async def populate_queue(
+    input_queue: asyncio.Queue,
+    urls: Iterable[str],
+    index: "ResumeIndex" = None,
+    validators: ValidatorCache = None,
+) -> int:
+    """
+    Populate input queue with (url, headers) tuples and add None at the end to stop workers.
+    Urls are read and their validators looked up in a thread executor, so reading from a slow file or stdin
+    and SQLite queries don't block the event loop
+    :param input_queue: asyncio.Queue for urls, reading waits while it is full
+    :param urls: iterable of string url addresses to be fetched
+    :param index: ResumeIndex object of fetched urls to skip
+    :param validators: ValidatorCache object for conditional request headers
+    :return: amount of skipped urls
+    """
+    loop = asyncio.get_running_loop()
+    urls = iter(urls)
+    skipped = 0
     while True:
-        url = await input_queue.get()
-        if url is None:
-            await output_queue.put(None)
+        batch, read = await loop.run_in_executor(None, read_batch, urls, index, validators)
+        if not read:
             break
-        else:
-            status = await fetch(url, session)
-            result = {"url": url, "status_code": status}
-            await output_queue.put(result)
+        skipped += read - len(batch)
+        for item in batch:
+            await input_queue.put(item)
+
+    await input_queue.put(None)
+    return skipped
 
 
-async def write_results(input_queue: asyncio.Queue, outfile) -> None:
+async def fetch_hedged(
+    url: str,
+    session: aiohttp.ClientSession,
+    scheduler: HostScheduler,
+    trace: dict = None,
+    prober: Prober = None,
+    headers: dict = None,
+) -> int:
     """
-    Start writing results to output file line by line
-    :param input_queue: asyncio.Queue populated with fetching results
-    :param outfile: file-like object to write to
+    Fetch url, sending a duplicate request if the first one is slower than usual for the host.
+    The first successful response wins and the other request is cancelled
+    :param url: string url address
+    :param session: aiohttp.ClientSession object
+    :param scheduler: HostScheduler object providing hedging delay and host slot for the duplicate
+    :param trace: dict updated with phase durations of the winning request
+    :param prober: Prober object, plain GET if None
+    :param headers: conditional request headers of the url, used by prober
+    :return: status code
+    """
+    delay = scheduler.hedge_delay(url)
+    traces = {}
+    tasks = set()
+
+    def start() -> None:
+        request_trace = {} if trace is not None else None
+        task = asyncio.create_task(fetch(url, session, request_trace, prober, headers))
+        traces[task] = request_trace
+        tasks.add(task)
+
+    start()
+    hedged = False
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and scheduler.try_hedge(url):
+                hedged = True
+                start()
+
+        while True:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.discard(task)
+                status = task.result()
+                if not is_transient(status) or not tasks:
+                    if trace is not None:
+                        trace.update(traces[task])
+                    return status
+    finally:
+        for task in tasks:
+            task.cancel()
+        if hedged:
+            scheduler.release(url)
+
+
+async def feed_scheduler(input_queue: asyncio.Queue, scheduler: HostScheduler) -> None:
+    """
+    Move urls from input queue to scheduler and close it at the end
+    :param input_queue: asyncio.Queue populated with (url, headers) tuples
+    :param scheduler: HostScheduler object
     :return: None
     """
     while True:
-        line = await input_queue.get()
-        if line is None:
+        item = await input_queue.get()
+        if item is None:
             break
-        else:
-            json.dump(line, outfile)
-            outfile.write("\n")
+        await scheduler.put(*item)
+
+    scheduler.close()
+
+
+async def fetch_urls(
+    input_queue: asyncio.Queue,
+    output_queue: asyncio.Queue,
+    session: aiohttp.ClientSession,
+    controller: ConcurrencyController,
+    scheduler: HostScheduler,
+    retries: int = MAX_RETRIES,
+    hedge: bool = False,
+    tracer: RequestTracer = None,
+    trace_fields: bool = False,
+    prober: Prober = None,
+) -> None:
+    """
+    Start fetching urls from input queue and writing results to output queue,
+    amount of concurrent requests is limited by controller and per host by scheduler
+    :param input_queue: asyncio.Queue populated with (url, headers) tuples
+    :param output_queue: asyncio.Queue for fetching results
+    :param session: aiohttp.ClientSession for making requests
+    :param controller: ConcurrencyController object
+    :param scheduler: HostScheduler object
+    :param retries: max amount of retries of transient failures
+    :param hedge: whether to send hedged requests
+    :param tracer: RequestTracer object of the session, requests aren't traced if None
+    :param trace_fields: whether to add phase durations to results
+    :param prober: Prober object to get statuses without downloading bodies, plain GET if None
+    :return: None
+    """
+    feeder = asyncio.create_task(feed_scheduler(input_queue, scheduler))
+    pending = set()
+    try:
+        while True:
+            await controller.acquire()
+            item = await scheduler.get()
+            if item is None:
+                controller.abort()
+                break
+            url, attempt, headers = item
+            task = asyncio.create_task(
+                fetch_one(
+                    url,
+                    attempt,
+                    session,
+                    controller,
+                    scheduler,
+                    output_queue,
+                    retries,
+                    hedge,
+                    tracer,
+                    trace_fields,
+                    prober,
+                    headers,
+                )
+            )
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        await feeder
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        # Requests must not outlive the session when the crawl is cancelled
+        feeder.cancel()
+        for task in list(pending):
+            task.cancel()
+    await output_queue.put(None)
+
+
+async def fetch_one(
+    url: str,
+    attempt: int,
+    session: aiohttp.ClientSession,
+    controller: ConcurrencyController,
+    scheduler: HostScheduler,
+    output_queue: asyncio.Queue,
+    retries: int,
+    hedge: bool,
+    tracer: RequestTracer = None,
+    trace_fields: bool = False,
+    prober: Prober = None,
+    headers: dict = None,
+) -> None:
+    """
+    Fetch url in slots taken from controller and scheduler and put result to output queue.
+    Transient failure is queued again after backoff delay until retries are exhausted
+    :param url: string url address
+    :param attempt: number of the attempt, starting from 0
+    :param session: aiohttp.ClientSession for making requests
+    :param controller: ConcurrencyController object, slot is released here
+    :param scheduler: HostScheduler object, host slot is released here
+    :param output_queue: asyncio.Queue for fetching results
+    :param retries: max amount of retries
+    :param hedge: whether to send hedged request for slow response
+    :param tracer: RequestTracer object of the session, request isn't traced if None
+    :param trace_fields: whether to add phase durations to result
+    :param prober: Prober object, plain GET if None
+    :param headers: conditional request headers of the url, used by prober
+    :return: None
+    """
+    status = CONNECTION_ERROR
+    error = None
+    trace = {} if tracer is not None else None
+    # Url stays unfinished only when it is queued again for a retry, otherwise scheduler.get would wait forever
+    retried = False
+    try:
+        t_start = time.perf_counter()
+        try:
+            if hedge:
+                status = await fetch_hedged(url, session, scheduler, trace, prober, headers)
+            else:
+                status = await fetch(url, session, trace, prober, headers)
+        except Exception as e:
+            # Anything fetch doesn't map to a status still finishes the url, as a failure
+            status = CLIENT_ERROR
+            error = type(e).__name__
+        finally:
+            latency = time.perf_counter() - t_start
+            controller.release(latency, is_error(status))
+            scheduler.release(url, latency)
+        if trace is not None:
+            trace["total"] = latency
+            tracer.record(url, trace)
+
+        if is_transient(status) and attempt < retries:
+            # Slots are free while waiting, the retry is scheduled like any other url
+            await asyncio.sleep(backoff_delay(attempt))
+            scheduler.retry(url, attempt + 1, headers)
+            retried = True
+            return
+
+        result = {"url": url, "status_code": status}
+        if error is not None:
+            result["error"] = error
+        if attempt:
+            result["attempts"] = attempt + 1
+        if status == NOT_MODIFIED and prober is not None:
+            result["unchanged"] = True
+        if trace_fields and trace is not None:
+            result["timings"] = {phase: round(trace[phase] * 1000, 3) for phase in tracer.PHASES if phase in trace}
+        await output_queue.put(result)
+    finally:
+        if not retried:
+            scheduler.done()
+
+
+def encode_result(result: dict) -> bytes:
+    """
+    Serialize result to a JSON line, with orjson if it is installed
+    :param result: fetching result
+    :return: bytes ending with a newline
+    """
+    if orjson is not None:
+        return orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(result).encode() + b"\n"
+
+
+def decode_result(line: bytes) -> dict:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+class BloomFilter(object):
+    """
+    Set of strings in a bit array of fixed size: membership test never misses an added string,
+    but can be a false positive with probability error_rate once capacity strings are added
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterator[int]:
+        # Double hashing: k positions from two 64 bit halves of a single digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> None:
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class ResumeIndex(object):
+    """
+    Index of urls already written to the results file, so that a restarted crawl skips them.
+    Urls are kept in a BloomFilter, checkpoint saves it with the results file offset it covers,
+    on load only results written after the last checkpoint are read
+    """
+
+    def __init__(
+        self,
+        results_fp: str,
+        capacity: int = RESUME_CAPACITY,
+        error_rate: float = RESUME_ERROR_RATE,
+        interval: float = CHECKPOINT_INTERVAL,
+    ):
+        """
+        :param results_fp: filepath of results, checkpoint files are stored next to it
+        :param capacity: expected amount of urls
+        :param error_rate: acceptable probability to skip a url that wasn't fetched
+        :param interval: min seconds between checkpoints
+        """
+        self.results_fp = results_fp
+        self.checkpoint_fp = results_fp + ".checkpoint"
+        self.bloom_fp = results_fp + ".bloom"
+        self.interval = interval
+        self.filter = BloomFilter(capacity, error_rate)
+        self.count = 0
+        self.offset = 0
+        self.saved_at = time.monotonic()
 
+    def __contains__(self, url: str) -> bool:
+        return url in self.filter
 
-async def main():
-    print(f"Processing {len(URLS)} urls...")
+    def add(self, url: str) -> None:
+        self.filter.add(url)
+        self.count += 1
+
+    def load(self) -> None:
+        """
+        Load last checkpoint and index results written after it.
+        A line cut by a crash at the end of results file is removed
+        :return: None
+        """
+        if os.path.exists(self.checkpoint_fp) and os.path.exists(self.bloom_fp):
+            with open(self.checkpoint_fp) as f:
+                checkpoint = json.load(f)
+            if (checkpoint["size"], checkpoint["hashes"]) == (self.filter.size, self.filter.hashes):
+                with open(self.bloom_fp, "rb") as f:
+                    self.filter.bits = bytearray(f.read())
+                self.count = checkpoint["count"]
+                self.offset = checkpoint["offset"]
+
+        if not os.path.exists(self.results_fp):
+            return
+        with open(self.results_fp, "rb+") as f:
+            if self.offset > os.fstat(f.fileno()).st_size:
+                # Results file was replaced, checkpoint doesn't describe it
+                self.filter = BloomFilter(self.filter.capacity, self.filter.error_rate)
+                self.count = self.offset = 0
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    f.truncate(self.offset)
+                    break
+                self.add(decode_result(line)["url"])
+                self.offset += len(line)
+
+    def save(self, offset: int) -> None:
+        """
+        Save checkpoint, results up to offset must be already written
+        :param offset: size of results file covered by the index
+        :return: None
+        """
+        self.offset = offset
+        # Bloom filter goes first: a crash in between leaves an older offset, and rereading results is harmless
+        with open(self.bloom_fp + ".tmp", "wb") as f:
+            f.write(self.filter.bits)
+        os.replace(self.bloom_fp + ".tmp", self.bloom_fp)
+        with open(self.checkpoint_fp + ".tmp", "w") as f:
+            json.dump({
+                "offset": offset,
+                "count": self.count,
+                "size": self.filter.size,
+                "hashes": self.filter.hashes,
+                "timestamp": time.time(),
+            }, f)
+        os.replace(self.checkpoint_fp + ".tmp", self.checkpoint_fp)
+        self.saved_at = time.monotonic()
+
+
+class ResultWriter(object):
+    """
+    Single writer stage draining results queue in batches. Batch is flushed when it reaches batch_size lines
+    or flush_interval seconds, the file is written in a thread executor while the next batch is collected
+    """
+
+    def __init__(
+        self,
+        outfile,
+        batch_size: int = WRITE_BATCH_SIZE,
+        flush_interval: float = WRITE_FLUSH_INTERVAL,
+        index: ResumeIndex = None,
+    ):
+        """
+        :param outfile: binary file-like object to write to
+        :param batch_size: max amount of lines buffered before writing
+        :param flush_interval: max seconds a line stays buffered
+        :param index: ResumeIndex object, written urls are added to it and checkpoints are saved after writes
+        """
+        self.outfile = outfile
+        self.index = index
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lines = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self._buffer = []
+        self._urls = []
+        self._write = None
+
+    def stats(self) -> dict:
+        return {
+            "lines": self.lines,
+            "bytes_written": self.bytes_written,
+            "batches": self.batches,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    async def run(self, input_queue: asyncio.Queue) -> None:
+        """
+        Write results until None is received
+        :param input_queue: asyncio.Queue populated with fetching results
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None
+        done = False
+        while not done:
+            if not self._buffer:
+                result = await input_queue.get()
+                deadline = loop.time() + self.flush_interval
+            else:
+                try:
+                    result = await asyncio.wait_for(input_queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    await self.flush()
+                    continue
+
+            self.queue_depth = input_queue.qsize()
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            # Everything already queued is taken without yielding to the event loop
+            while result is not None:
+                self._buffer.append(encode_result(result))
+                self._urls.append(result["url"])
+                if len(self._buffer) >= self.batch_size or input_queue.empty():
+                    break
+                result = input_queue.get_nowait()
+            done = result is None
+
+            if done or len(self._buffer) >= self.batch_size or loop.time() >= deadline:
+                await self.flush()
+
+        if self._write is not None:
+            await self._write
+        if self.index is not None:
+            await loop.run_in_executor(None, self._checkpoint)
+
+    async def flush(self) -> None:
+        """
+        Start writing buffered lines, waiting for the previous write first so that lines keep their order
+        :return: None
+        """
+        if self._write is not None:
+            await self._write
+            self._write = None
+        if not self._buffer:
+            return
+
+        data = b"".join(self._buffer)
+        self.lines += len(self._buffer)
+        self.bytes_written += len(data)
+        self.batches += 1
+        urls = self._urls
+        self._buffer = []
+        self._urls = []
+        self._write = asyncio.get_running_loop().run_in_executor(None, self._write_data, data, urls)
+
+    def _write_data(self, data: bytes, urls: list[str]) -> None:
+        self.outfile.write(data)
+        self.outfile.flush()
+        if self.index is not None:
+            for url in urls:
+                self.index.add(url)
+            if time.monotonic() - self.index.saved_at >= self.index.interval:
+                self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        os.fsync(self.outfile.fileno())
+        self.index.save(self.outfile.tell())
+
+
+async def main(
+    urls: Iterable[str] = URLS,
+    fp: str = "results.jsonl",
+    controller: ConcurrencyController = None,
+    resume: bool = False,
+    scheduler: HostScheduler = None,
+    retries: int = MAX_RETRIES,
+    hedge: bool = False,
+    trace: bool = True,
+    trace_fields: bool = False,
+    probe: bool = False,
+    validators: str = None,
+    resume_capacity: int = RESUME_CAPACITY,
+    **session_options,
+) -> dict:
+    """
+    Fetch urls and append results to a file
+    :param urls: iterable of string url addresses to be fetched, e.g. read_urls() output
+    :param fp: filepath of results
+    :param controller: ConcurrencyController object, adaptive from NUMBER_OF_WORKERS if None
+    :param resume: whether to skip urls already in results file and save checkpoints
+    :param scheduler: HostScheduler object, with default per host limits if None
+    :param retries: max amount of retries of transient failures
+    :param hedge: whether to send hedged requests for slow responses
+    :param trace: whether to record request phase durations and print their percentiles
+    :param trace_fields: whether to add phase durations in milliseconds to results as "timings"
+    :param probe: whether to send HEAD instead of GET, with fallback to GET of the first byte
+    :param validators: filepath of ValidatorCache for conditional requests, unconditional requests if None
+    :param resume_capacity: expected amount of urls in results file, sizes the index used to resume
+    :param session_options: keyword arguments of make_session
+    :return: dict with execution time, final concurrency limit, amount of skipped urls,
+        scheduler, writer and prober counters, latency percentiles and RequestTracer object
+    """
+    print("Processing urls...")
     t_start = time.perf_counter()
+    if controller is None:
+        controller = ConcurrencyController()
+    if scheduler is None:
+        scheduler = HostScheduler()
+    tracer = RequestTracer() if trace else None
+    prober = None
+    validator_cache = ValidatorCache(validators) if validators is not None else None
+    if probe or validator_cache is not None:
+        prober = Prober(probe, validator_cache)
+    if tracer is not None:
+        session_options["trace_configs"] = [tracer.make_trace_config()]
 
-    input_queue = asyncio.Queue(len(URLS))
-    output_queue = asyncio.Queue(len(URLS))
+    index = None
+    if resume:
+        index = ResumeIndex(fp, resume_capacity)
+        await asyncio.get_running_loop().run_in_executor(None, index.load)
+        print(f"Resuming after {index.count} fetched urls")
 
-    with open("results.jsonl", "a") as f:
-        async with aiohttp.ClientSession() as session:
-            tasks = [asyncio.create_task(populate_queue(input_queue, URLS))]
-            for i in range(NUMBER_OF_WORKERS):
-                tasks += [
-                    asyncio.create_task(fetch_urls(input_queue, output_queue, session)),
-                    asyncio.create_task(write_results(output_queue, f))
-                ]
+    input_queue = asyncio.Queue(QUEUE_SIZE)
+    output_queue = asyncio.Queue(QUEUE_SIZE)
 
-            await asyncio.gather(*tasks)
+    with open(fp, "ab") as f:
+        writer = ResultWriter(f, index=index)
+        async with make_session(**session_options) as session:
+            tasks = [
+                asyncio.create_task(populate_queue(input_queue, urls, index, validator_cache)),
+                asyncio.create_task(
+                    fetch_urls(
+                        input_queue,
+                        output_queue,
+                        session,
+                        controller,
+                        scheduler,
+                        retries,
+                        hedge,
+                        tracer,
+                        trace_fields,
+                        prober,
+                    )
+                ),
+                asyncio.create_task(writer.run(output_queue)),
+            ]
+
+            skipped, _, _ = await asyncio.gather(*tasks)
+
+    if prober is not None and prober.cache is not None:
+        await prober.cache.flush()
+        prober.cache.close()
 
     exec_time = time.perf_counter() - t_start
-    print(f"Done in {exec_time} seconds")
+    print(
+        f"Done in {exec_time} seconds, {writer.lines} urls fetched, {skipped} skipped, "
+        f"final concurrency {controller.limit}, {writer.bytes_written} bytes written in {writer.batches} batches"
+    )
+    if tracer is not None:
+        print(tracer.report())
+    return {
+        "exec_time": exec_time,
+        "concurrency": controller.limit,
+        "history": controller.history,
+        "skipped": skipped,
+        "scheduler": scheduler.stats(),
+        "writer": writer.stats(),
+        "latency": tracer.summary() if tracer is not None else None,
+        "tracer": tracer,
+        "prober": prober.stats() if prober is not None else None,
+    }
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Fetch status codes of urls")
+    parser.add_argument("input", nargs="?", help="file with a url per line, - for stdin, built-in urls if omitted")
+    parser.add_argument("--output", default="results.jsonl")
+    parser.add_argument("--resume", action="store_true", help="skip urls already in output")
+    parser.add_argument(
+        "--resume-capacity", type=int, default=RESUME_CAPACITY, help="expected amount of urls in output for --resume"
+    )
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--hedge", action="store_true", help="send duplicate request when response is slow")
+    parser.add_argument("--no-trace", dest="trace", action="store_false", help="don't record request phase durations")
+    parser.add_argument("--trace-fields", action="store_true", help="add request phase durations to results")
+    parser.add_argument("--probe", action="store_true", help="send HEAD, or GET of the first byte, instead of GET")
+    parser.add_argument("--validators", help="SQLite file of ETag/Last-Modified for conditional requests")
+    options = parser.parse_args()
+
+    asyncio.run(main(
+        read_urls(options.input) if options.input else URLS,
+        options.output,
+        resume=options.resume,
+        retries=options.retries,
+        hedge=options.hedge,
+        trace=options.trace,
+        trace_fields=options.trace_fields,
+        probe=options.probe,
+        validators=options.validators,
+        resume_capacity=options.resume_capacity,
+    ))
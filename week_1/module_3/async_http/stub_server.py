@@ -0,0 +1,141 @@
+import asyncio
+import collections
+import random
+import time
+
+from aiohttp import web
+
+
+class StubServer(object):
+    """
+    Local aiohttp server answering /status/{code} with given status after injected latency.
+    Only `capacity` requests are served at once and others wait for a slot, so latency grows under overload
+    as on a real backend; requests beyond `capacity + backlog` are rejected with 503 right away.
+    /slow/{code} always takes slow_latency, /tail/{code} takes slow_latency with probability tail_rate,
+    /flaky/{code} fails with 503 with probability failure_rate.
+    /page/{code} has a body of body_size bytes with ETag and Last-Modified, supports conditional and ranged GET,
+    /nohead/{code} is the same page answering HEAD with 405, /loop/{code} redirects to itself
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        jitter: float = 0.,
+        capacity: int = 50,
+        backlog: int = 50,
+        slow_latency: float = 1.,
+        tail_rate: float = 0.05,
+        failure_rate: float = 0.2,
+        body_size: int = 100_000,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.backlog = backlog
+        self.slow_latency = slow_latency
+        self.tail_rate = tail_rate
+        self.failure_rate = failure_rate
+        self.body = b"x" * body_size
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.methods = collections.Counter()
+        self.active = 0
+        self.max_active = 0
+        # time.perf_counter() when the last response was ready
+        self.finished_at = None
+        self.runner = None
+        self._slots = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/status/{code}", self.handle_status)
+        app.router.add_route("*", "/slow/{code}", self.handle_status)
+        app.router.add_route("*", "/tail/{code}", self.handle_status)
+        app.router.add_route("*", "/flaky/{code}", self.handle_status)
+        app.router.add_route("*", "/page/{code}", self.handle_page)
+        app.router.add_route("*", "/nohead/{code}", self.handle_page)
+        app.router.add_route("*", "/loop/{code}", self.handle_loop)
+        return app
+
+    def get_latency(self, path: str) -> float:
+        if path.startswith("/slow/") or path.startswith("/tail/") and random.random() < self.tail_rate:
+            return self.slow_latency
+        return self.latency + random.uniform(0, self.jitter)
+
+    async def handle_status(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if request.path.startswith("/flaky/") and random.random() < self.failure_rate:
+            self.failed += 1
+            return web.Response(status=503)
+        if self.active >= self.capacity + self.backlog:
+            self.rejected += 1
+            return web.Response(status=503)
+
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            async with self._slots:
+                await asyncio.sleep(self.get_latency(request.path))
+        finally:
+            self.active -= 1
+        self.finished_at = time.perf_counter()
+        return web.Response(status=int(request.match_info["code"]))
+
+    async def handle_page(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.methods[request.method] += 1
+        if request.method == "HEAD" and request.path.startswith("/nohead/"):
+            return web.Response(status=405)
+        await asyncio.sleep(self.latency)
+
+        headers = {"ETag": f'"{request.path}"', "Last-Modified": "Mon, 05 Oct 2026 10:00:00 GMT"}
+        if request.headers.get("If-None-Match") == headers["ETag"]:
+            return web.Response(status=304, headers=headers)
+        if request.method == "HEAD":
+            return web.Response(status=int(request.match_info["code"]), headers=headers)
+
+        body = self.body
+        status = int(request.match_info["code"])
+        if request.headers.get("Range") == "bytes=0-0":
+            body = body[:1]
+            status = 206
+            headers["Content-Range"] = f"bytes 0-0/{len(self.body)}"
+        self.bytes_sent += len(body)
+        return web.Response(status=status, body=body, headers=headers)
+
+    async def handle_loop(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        raise web.HTTPFound(request.path_qs)
+
+    async def start(self) -> str:
+        """
+        Start serving, a free port is picked if port is 0
+        :return: base url of the server
+        """
+        self._slots = asyncio.Semaphore(self.capacity)
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        return self.url
+
+    async def close(self) -> None:
+        await self.runner.cleanup()
+
+    async def __aenter__(self) -> "StubServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
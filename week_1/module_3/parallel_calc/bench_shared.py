@@ -0,0 +1,47 @@
+import resource
+import sys
+import time
+from multiprocessing import Process, Queue
+
+from main import generate_data, run_mp_process, run_mp_shared
+
+STRATEGIES = {
+    "multiprocessing_Process_Queue": run_mp_process,
+    "multiprocessing_Process_shared_memory": run_mp_shared,
+}
+
+
+def measure(name: str, count: int, output: Queue) -> None:
+    """
+    Run a strategy in a fresh process so that peak RSS of different strategies doesn't mix
+    :param name: strategy name
+    :param count: amount of numbers to process
+    :param output: Queue object for (processing time, parent peak RSS, workers peak RSS)
+    :return: None
+    """
+    numbers = generate_data(count)
+    t_start = time.perf_counter()
+    STRATEGIES[name](numbers)
+    all_time = time.perf_counter() - t_start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    parent_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    workers_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    output.put((all_time, parent_rss, workers_rss))
+
+
+if __name__ == "__main__":
+    for count in [10 ** i for i in range(3, 7)]:
+        print("-" * 24)
+        print(f"N = {count}")
+        for name in STRATEGIES:
+            output = Queue()
+            process = Process(target=measure, args=(name, count, output))
+            process.start()
+            all_time, parent_rss, workers_rss = output.get()
+            process.join()
+            print(
+                f"{name:>38}: {count / all_time:12,.0f} numbers/s, "
+                f"peak RSS parent {parent_rss / 2 ** 20:8.1f} MiB, worker {workers_rss / 2 ** 20:8.1f} MiB"
+            )
@@ -0,0 +1,243 @@
+import argparse
+import csv
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from main import (
+    generate_data,
+    get_worker_pool,
+    run_dedup,
+    run_dedup_table,
+    run_mp_pool,
+    run_mp_process,
+    run_numpy,
+    run_single_thread,
+    run_tpe,
+    run_work_stealing,
+    run_worker_pool,
+)
+
+# Slowdowns below this many seconds are timer and scheduler noise, e.g. a few microseconds for N = 10
+MIN_REGRESSION_DELTA = 0.001
+# Slowdown must also exceed this many standard deviations of the compared measurements
+NOISE_SIGMAS = 3
+# Names match the columns of data/performance.csv
+STRATEGIES = {
+    "Single Thread": run_single_thread,
+    "ThreadPoolExecutor": run_tpe,
+    "multiprocessing_Pool": run_mp_pool,
+    "multiprocessing_Process_Queue": run_mp_process,
+    "numpy": run_numpy,
+    "persistent_WorkerPool": run_worker_pool,
+    "work_stealing": run_work_stealing,
+    "dedup": run_dedup,
+    "dedup_lookup_table": run_dedup_table,
+}
+
+
+def describe_environment() -> dict:
+    return {
+        "cpu_count": os.cpu_count(),
+        "python": sys.version,
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+    }
+
+
+def summarize(samples: list[float]) -> dict:
+    """
+    Summary statistics of timing samples
+    :param samples: list of execution times in seconds
+    :return: dict with median, p95, mean, stdev, min and max
+    """
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, max(0, round(0.95 * len(ordered)) - 1))
+    return {
+        "median": statistics.median(ordered),
+        "p95": ordered[p95_index],
+        "mean": statistics.fmean(ordered),
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.,
+        "min": ordered[0],
+        "max": ordered[-1],
+        "samples": samples,
+    }
+
+
+def bench_strategy(func, numbers: list[int], expected: list[int], warmup: int, repeat: int) -> dict:
+    """
+    Time a strategy after warmup runs, checking its results
+    :param func: strategy function
+    :param numbers: list of numbers
+    :param expected: reference results
+    :param warmup: amount of untimed runs
+    :param repeat: amount of timed runs
+    :return: summary of compute times
+    """
+    samples = []
+    for i in range(warmup + repeat):
+        t_start = time.perf_counter()
+        results = func(numbers)
+        all_time = time.perf_counter() - t_start
+        if results != expected:
+            raise AssertionError(f"{func.__name__} returned wrong results for {len(numbers)} numbers")
+        if i >= warmup:
+            samples.append(all_time)
+
+    return summarize(samples)
+
+
+def load_baseline(fp: str) -> dict:
+    """
+    Load baseline median times from performance.csv written by main.py or from a previous JSON report.
+    performance.csv has a single sample per size, so its standard deviation is 0
+    :param fp: filepath of the baseline
+    :return: dict {strategy: {count: (median seconds, stdev seconds)}}
+    """
+    baseline = {}
+    if fp.endswith(".json"):
+        with open(fp) as f:
+            report = json.load(f)
+        for name, sizes in report["results"].items():
+            baseline[name] = {
+                int(count): (result["compute"]["median"], result["compute"]["stdev"]) for count, result in sizes.items()
+            }
+        return baseline
+
+    with open(fp, newline="") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            count = int(row["number"])
+            for name, value in row.items():
+                if name != "number" and value:
+                    baseline.setdefault(name, {})[count] = (float(value), 0.)
+
+    return baseline
+
+
+def find_regressions(
+        results: dict,
+        baseline: dict,
+        threshold: float,
+        min_delta: float = MIN_REGRESSION_DELTA,
+) -> list[dict]:
+    """
+    Compare median times with the baseline. A slowdown is a regression only if it is above the relative threshold,
+    above min_delta seconds and above NOISE_SIGMAS standard deviations of both measurements
+    :param results: dict {strategy: {count: result}}
+    :param baseline: dict {strategy: {count: (median seconds, stdev seconds)}}
+    :param threshold: allowed relative slowdown, e.g. 0.1 for 10%
+    :param min_delta: allowed absolute slowdown in seconds
+    :return: list of regressions
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for count, result in sizes.items():
+            reference, reference_stdev = baseline.get(name, {}).get(count, (None, 0.))
+            median = result["compute"]["median"]
+            noise = NOISE_SIGMAS * math.hypot(reference_stdev, result["compute"]["stdev"])
+            if reference and median > reference * (1 + threshold) and median - reference > max(min_delta, noise):
+                regressions.append({
+                    "strategy": name,
+                    "count": count,
+                    "median": median,
+                    "baseline": reference,
+                    "slowdown": median / reference - 1,
+                })
+
+    return regressions
+
+
+def save_plot(results: dict, fp: str) -> None:
+    """
+    Plot median compute time against amount of numbers
+    :param results: dict {strategy: {count: result}}
+    :param fp: image filepath
+    :return: None
+    """
+    fig, ax = plt.subplots()
+    for name, sizes in results.items():
+        counts = sorted(sizes)
+        ax.plot(counts, [sizes[count]["compute"]["median"] for count in counts], label=name, marker="o")
+    ax.set_xscale("log")
+    ax.set_yscale("log")
+    ax.set_xlabel("numbers")
+    ax.set_ylabel("median time, s")
+    ax.legend()
+    fig.savefig(fp)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark number processing strategies")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10 ** i for i in range(1, 6)])
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES))
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="data/benchmark.json")
+    parser.add_argument("--plot", default="data/benchmark.png")
+    parser.add_argument("--baseline", default=None, help="performance.csv or benchmark JSON to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown against baseline")
+    parser.add_argument(
+        "--min-delta", type=float, default=MIN_REGRESSION_DELTA, help="allowed absolute slowdown in seconds"
+    )
+    options = parser.parse_args()
+
+    t_start = time.perf_counter()
+    pool_startup = get_worker_pool().startup_time
+    print(f"Persistent worker pool started in {pool_startup:.4f} seconds.")
+
+    results = {name: {} for name in options.strategies}
+    for count in options.sizes:
+        print("-" * 24)
+        t_setup = time.perf_counter()
+        numbers = generate_data(count)
+        expected = run_numpy(numbers)
+        setup_time = time.perf_counter() - t_setup
+        print(f"N = {count}, setup {setup_time:.4f} seconds")
+
+        for name in options.strategies:
+            summary = bench_strategy(STRATEGIES[name], numbers, expected, options.warmup, options.repeat)
+            results[name][count] = {"setup": setup_time, "compute": summary}
+            print(
+                f"{name:>30}: median {summary['median']:.6f} s, p95 {summary['p95']:.6f} s, "
+                f"stdev {summary['stdev']:.6f} s"
+            )
+
+    report = {
+        "environment": describe_environment(),
+        "options": vars(options),
+        "pool_startup": pool_startup,
+        "total_time": time.perf_counter() - t_start,
+        "results": results,
+    }
+
+    exit_code = 0
+    if options.baseline:
+        regressions = find_regressions(results, load_baseline(options.baseline), options.threshold, options.min_delta)
+        report["regressions"] = regressions
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['strategy']} N = {regression['count']}: "
+                f"{regression['median']:.6f} s vs baseline {regression['baseline']:.6f} s "
+                f"(+{regression['slowdown']:.0%})"
+            )
+        exit_code = 1 if regressions else 0
+
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=2)
+    save_plot(results, options.plot)
+    print(f"Results saved to {options.output}, plot saved to {options.plot}")
+
+    sys.exit(exit_code)
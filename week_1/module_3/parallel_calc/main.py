@@ -2,9 +2,33 @@ import random
 import os
 import time
 import csv
+import array
+import atexit
+import collections
+import heapq
+import multiprocessing
 import matplotlib.pyplot as plt
+import numpy as np
 from concurrent.futures import ThreadPoolExecutor
-from multiprocessing import Pool, Process, Queue
+from typing import Iterator
+from multiprocessing import Array, Pool, Process, Queue, shared_memory
+
+# Target duration of processing a single chunk, long enough to amortize IPC and short enough to balance load
+CHUNK_TIME = 0.05
+# Min amount of chunks every worker gets, so that a slow chunk doesn't leave other workers idle at the end
+CHUNKS_PER_WORKER = 4
+# Amount of numbers timed in the parent process to estimate per-item cost
+COST_SAMPLE_SIZE = 100
+# Start method of the persistent worker pool: "fork", "forkserver", "spawn" or None for the platform default
+START_METHOD = os.environ.get("PARALLEL_CALC_START_METHOD") or None
+# Amount of chunks per worker for the work-stealing scheduler, more chunks give finer balancing
+STEALING_CHUNKS_PER_WORKER = 16
+# On-disk lookup table shared by runs and processes: byte n is 0 if n is not classified yet, else result + 1
+LOOKUP_TABLE_PATH = "data/prime_table.bin"
+# Amount of numbers generated and processed at once in streaming mode
+STREAM_CHUNK_SIZE = 100_000
+# Record layout of the binary streaming output
+STREAM_DTYPE = np.dtype([("number", "<i8"), ("result", "u1")])
 
 
 def generate_data(n: int = 1) -> list[int]:
@@ -36,28 +60,292 @@ def process_number(number: int) -> int:
         return 0
 
 
-def get_task_queue(numbers: list[int]) -> Queue:
+def prime_sieve(limit: int) -> np.ndarray:
     """
-    Populate task queue
+    Sieve of Eratosthenes
+    :param limit: max number to classify
+    :return: array of limit + 1 elements where element n is 1 if n is prime and 0 otherwise
+    """
+    sieve = np.ones(limit + 1, dtype=np.uint8)
+    sieve[:2] = 0
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = 0
+
+    return sieve
+
+
+def process_batch(numbers) -> array.array:
+    """
+    Process a chunk of numbers
+    :param numbers: sequence of numbers
+    :return: array of numbers (0, 1)
+    """
+    return array.array("b", [process_number(number) for number in numbers])
+
+
+def get_chunk_size(numbers: list[int], workers: int) -> int:
+    """
+    Choose chunk size from measured per-item cost and amount of workers
+    :param numbers: list of numbers
+    :param workers: amount of worker processes
+    :return: amount of numbers in a chunk
+    """
+    if not numbers:
+        return 1
+
+    step = max(1, len(numbers) // COST_SAMPLE_SIZE)
+    sample = numbers[::step][:COST_SAMPLE_SIZE]
+    t_start = time.perf_counter()
+    process_batch(sample)
+    item_time = max((time.perf_counter() - t_start) / len(sample), 1e-9)
+
+    chunk_size = int(CHUNK_TIME / item_time)
+    max_chunk_size = len(numbers) // (workers * CHUNKS_PER_WORKER)
+    return max(1, min(chunk_size, max_chunk_size))
+
+
+def get_task_queue(numbers: list[int], chunk_size: int = 1) -> tuple[Queue, int]:
+    """
+    Populate task queue with chunks of numbers
     :param numbers: list of numbers
-    :return: Queue object
+    :param chunk_size: amount of numbers in a chunk
+    :return: Queue object with (start index, array of numbers) tasks and amount of tasks
     """
     task_queue = Queue()
-    for number in numbers:
-        task_queue.put(number)
-    return task_queue
+    count = 0
+    for start in range(0, len(numbers), chunk_size):
+        task_queue.put((start, array.array("q", numbers[start:start + chunk_size])))
+        count += 1
+    return task_queue, count
 
 
 def worker(input: Queue, output: Queue) -> None:
     """
     Multiprocessing worker
-    :param input: Queue object with input data
-    :param output: Queue object with output data
+    :param input: Queue object with (start index, array of numbers) tasks
+    :param output: Queue object with (start index, array of results) results
+    :return: None
+    """
+    for start, chunk in iter(input.get, "STOP"):
+        output.put((start, process_batch(chunk)))
+
+
+def shared_worker(input_name: str, output_name: str, count: int, tasks: Queue) -> None:
+    """
+    Multiprocessing worker reading numbers from and writing results to shared memory
+    :param input_name: name of shared memory block with count int64 numbers
+    :param output_name: name of shared memory block with count result bytes
+    :param count: amount of numbers
+    :param tasks: Queue object with (start, stop) index ranges
+    :return: None
+    """
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    numbers = input_shm.buf[:count * 8].cast("q")
+    results = output_shm.buf
+    try:
+        for start, stop in iter(tasks.get, "STOP"):
+            results[start:stop] = bytes(process_number(number) for number in numbers[start:stop])
+    finally:
+        # Views must be released before the blocks can be closed
+        numbers.release()
+        results.release()
+        input_shm.close()
+        output_shm.close()
+
+
+def estimate_cost(number: int) -> float:
+    """
+    Default cost model: process_number is O(n)
+    :param number: number to process
+    :return: estimated cost
+    """
+    return float(number)
+
+
+def make_cost_chunks(numbers: list[int], chunk_count: int, cost_model=estimate_cost) -> list[tuple[int, int, float]]:
+    """
+    Split numbers into contiguous chunks of about the same estimated cost
+    :param numbers: list of numbers
+    :param chunk_count: desired amount of chunks
+    :param cost_model: callable estimating cost of a number
+    :return: list of (start, stop, cost) tuples
+    """
+    costs = [cost_model(number) for number in numbers]
+    chunk_cost = max(sum(costs) / chunk_count, 1e-9)
+
+    chunks = []
+    start = 0
+    cost = 0.
+    for i, item_cost in enumerate(costs):
+        cost += item_cost
+        if cost >= chunk_cost:
+            chunks.append((start, i + 1, cost))
+            start = i + 1
+            cost = 0.
+    if start < len(numbers):
+        chunks.append((start, len(numbers), cost))
+
+    return chunks
+
+
+def take_task(bounds, tasks: list, own: bool):
+    """
+    Take task from a worker's deque
+    :param bounds: multiprocessing.Array with [head, tail] indexes of not taken tasks
+    :param tasks: worker's tasks sorted by decreasing cost
+    :param own: whether the deque belongs to the caller, owner takes the biggest tasks, thieves the smallest
+    :return: task or None if deque is empty
+    """
+    with bounds.get_lock():
+        head, tail = bounds[0], bounds[1]
+        if head >= tail:
+            return None
+        if own:
+            bounds[0] = head + 1
+            return tasks[head]
+        bounds[1] = tail - 1
+        return tasks[tail - 1]
+
+
+def stealing_worker(
+        worker_id: int,
+        input_name: str,
+        count: int,
+        task_lists: list[list],
+        bounds: list,
+        output: Queue,
+) -> None:
+    """
+    Multiprocessing worker processing own tasks first and then stealing tasks of other workers.
+    Numbers are read from shared memory, so that every worker doesn't get a copy of the whole input
+    :param worker_id: index of own deque
+    :param input_name: name of shared memory block with count int64 numbers
+    :param count: amount of numbers
+    :param task_lists: lists of (start, stop) index ranges of all workers
+    :param bounds: list of multiprocessing.Array with [head, tail] of every deque
+    :param output: Queue object for ("result", start, results) and ("stats", worker_id, busy time, tasks, stolen)
+    :return: None
+    """
+    busy_time = 0.
+    tasks_done = 0
+    stolen = 0
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    numbers = input_shm.buf[:count * 8].cast("q")
+    try:
+        victims = [(worker_id + i) % len(task_lists) for i in range(len(task_lists))]
+        for victim in victims:
+            while True:
+                task = take_task(bounds[victim], task_lists[victim], victim == worker_id)
+                if task is None:
+                    break
+                start, stop = task
+                t_start = time.perf_counter()
+                results = process_batch(numbers[start:stop])
+                busy_time += time.perf_counter() - t_start
+                tasks_done += 1
+                stolen += victim != worker_id
+                output.put(("result", start, results))
+    finally:
+        numbers.release()
+        input_shm.close()
+
+    output.put(("stats", worker_id, busy_time, tasks_done, stolen))
+
+
+def schedule_work_stealing(numbers: list[int], workers: int = None, cost_model=estimate_cost) -> tuple[list, list]:
+    """
+    Balance chunks between workers by estimated cost, idle workers steal remaining chunks of busy ones
+    :param numbers: list of numbers
+    :param workers: amount of worker processes, os.cpu_count() if None
+    :param cost_model: callable estimating cost of processing a number
+    :return: list of numbers (0, 1) and list of per worker stats dicts
+    """
+    workers = workers or os.cpu_count()
+    results = [0] * len(numbers)
+    if not numbers:
+        return results, []
+
+    # Longest processing time first: the biggest chunk goes to the least loaded worker
+    chunks = make_cost_chunks(numbers, workers * STEALING_CHUNKS_PER_WORKER, cost_model)
+    chunks.sort(key=lambda chunk: chunk[2], reverse=True)
+    task_lists = [[] for _ in range(workers)]
+    estimated = [0.] * workers
+    loads = [(0., i) for i in range(workers)]
+    for start, stop, cost in chunks:
+        load, i = heapq.heappop(loads)
+        task_lists[i].append((start, stop))
+        estimated[i] += cost
+        heapq.heappush(loads, (load + cost, i))
+    bounds = [Array("i", [0, len(tasks)]) for tasks in task_lists]
+
+    count = len(numbers)
+    input_shm = shared_memory.SharedMemory(create=True, size=count * 8)
+    processes = []
+    try:
+        view = input_shm.buf[:count * 8].cast("q")
+        view[:] = array.array("q", numbers)
+        view.release()
+
+        output = Queue()
+        t_start = time.perf_counter()
+        processes = [
+            Process(target=stealing_worker, args=(i, input_shm.name, count, task_lists, bounds, output))
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        stats = [None] * workers
+        pending = workers
+        while pending:
+            message = output.get()
+            if message[0] == "result":
+                _, start, chunk_results = message
+                results[start:start + len(chunk_results)] = chunk_results
+            else:
+                _, worker_id, busy_time, tasks_done, stolen = message
+                stats[worker_id] = {"busy": busy_time, "tasks": tasks_done, "stolen": stolen}
+                pending -= 1
+        all_time = time.perf_counter() - t_start
+
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        input_shm.close()
+        input_shm.unlink()
+    for i, worker_stats in enumerate(stats):
+        worker_stats["estimated_cost"] = estimated[i]
+        worker_stats["idle"] = max(0., all_time - worker_stats["busy"])
+
+    return results, stats
+
+
+def run_work_stealing(numbers: list[int]) -> list[int]:
+    """
+    Run number processing with cost-aware work-stealing scheduler
+    :param numbers: list of numbers
+    :return: list of numbers (0, 1)
+    """
+    results, _ = schedule_work_stealing(numbers)
+    return results
+
+
+def print_worker_stats(stats: list[dict]) -> None:
+    """
+    Print per worker load of the work-stealing scheduler
+    :param stats: list of per worker stats dicts returned by schedule_work_stealing
     :return: None
     """
-    for num in iter(input.get, "STOP"):
-        result = process_number(num)
-        output.put(result)
+    for i, worker_stats in enumerate(stats):
+        print(
+            f"Worker {i}: busy {worker_stats['busy']:.4f} s, idle {worker_stats['idle']:.4f} s, "
+            f"{worker_stats['tasks']} tasks ({worker_stats['stolen']} stolen)"
+        )
 
 
 def time_func(func, *args, **kwargs):
@@ -105,8 +393,10 @@ def run_mp_pool(numbers: list[int]) -> list[int]:
     :param numbers: list of numbers
     :return: list of numbers (0, 1)
     """
-    with Pool(os.cpu_count()) as pool:
-        results = list(pool.map(process_number, numbers))
+    workers = os.cpu_count()
+    chunk_size = get_chunk_size(numbers, workers)
+    with Pool(workers) as pool:
+        results = list(pool.map(process_number, numbers, chunksize=chunk_size))
 
     return results
 
@@ -117,22 +407,338 @@ def run_mp_process(numbers: list[int]) -> list[int]:
     :param numbers: list of numbers
     :return: list of numbers (0, 1)
     """
-    task_queue = get_task_queue(numbers)
+    workers = os.cpu_count()
+    task_queue, task_count = get_task_queue(numbers, get_chunk_size(numbers, workers))
     done_queue = Queue()
-    results = []
+    results = [0] * len(numbers)
+
+    for i in range(workers):
+        task_queue.put("STOP")
+    processes = [Process(target=worker, args=(task_queue, done_queue)) for _ in range(workers)]
+    for process in processes:
+        process.start()
 
-    for i in range(os.cpu_count()):
-        Process(target=worker, args=(task_queue, done_queue)).start()
+    # Chunks complete in any order, their start index puts results back in input order
+    for i in range(task_count):
+        start, chunk_results = done_queue.get()
+        results[start:start + len(chunk_results)] = chunk_results
 
-    for i in range(len(numbers)):
-        results.append(done_queue.get())
+    for process in processes:
+        process.join()
 
-    for i in range(os.cpu_count()):
-        task_queue.put('STOP')
+    return results
+
+
+def run_mp_shared(numbers: list[int]) -> list[int]:
+    """
+    Run number processing in multiprocessing.Process with input and output in shared memory,
+    only (start, stop) index ranges pass through the queue
+    :param numbers: list of numbers
+    :return: list of numbers (0, 1)
+    """
+    count = len(numbers)
+    if not count:
+        return []
+
+    workers = os.cpu_count()
+    chunk_size = get_chunk_size(numbers, workers)
+    input_shm = shared_memory.SharedMemory(create=True, size=count * 8)
+    output_shm = shared_memory.SharedMemory(create=True, size=count)
+    processes = []
+    try:
+        view = input_shm.buf[:count * 8].cast("q")
+        view[:] = array.array("q", numbers)
+        view.release()
+
+        tasks = Queue()
+        for start in range(0, count, chunk_size):
+            tasks.put((start, min(start + chunk_size, count)))
+        for i in range(workers):
+            tasks.put("STOP")
+
+        processes = [
+            Process(target=shared_worker, args=(input_shm.name, output_shm.name, count, tasks)) for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        crashed = [process.exitcode for process in processes if process.exitcode != 0]
+        if crashed:
+            raise RuntimeError(f"{len(crashed)} shared memory workers crashed, exit codes {crashed}")
+
+        results = list(output_shm.buf[:count])
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        input_shm.close()
+        input_shm.unlink()
+        output_shm.close()
+        output_shm.unlink()
 
     return results
 
 
+def run_numpy(numbers: list[int]) -> list[int]:
+    """
+    Run number processing for the whole input at once: sieve up to max number and gather results by indexing
+    :param numbers: list of numbers
+    :return: list of numbers (0, 1)
+    """
+    array = np.asarray(numbers, dtype=np.int64)
+    results = np.zeros(array.shape, dtype=np.uint8)
+    candidates = array > 1
+    if candidates.any():
+        sieve = prime_sieve(int(array.max()))
+        results[candidates] = sieve[array[candidates]]
+
+    return results.tolist()
+
+
+def warm_up_worker() -> None:
+    """
+    Worker pool initializer: run processing once so that lazy imports and caches are primed before timed work
+    :return: None
+    """
+    process_batch(range(1000))
+
+
+class WorkerPool(object):
+    """
+    Long-lived pool of worker processes, started and warmed up once and reused between runs
+    """
+
+    def __init__(self, processes: int = None, start_method: str = None):
+        """
+        :param processes: amount of worker processes, os.cpu_count() if None
+        :param start_method: "fork", "forkserver", "spawn" or None for the platform default
+        """
+        self.processes = processes or os.cpu_count()
+        self.context = multiprocessing.get_context(start_method)
+        self.pool = None
+        self.startup_time = 0.
+
+    def start(self) -> "WorkerPool":
+        """
+        Start and warm up worker processes if they are not running yet
+        :return: self
+        """
+        if self.pool is None:
+            t_start = time.perf_counter()
+            self.pool = self.context.Pool(self.processes, initializer=warm_up_worker)
+            # Round trip through every worker, so that startup isn't billed to the first run
+            self.pool.map(process_number, range(self.processes), chunksize=1)
+            self.startup_time = time.perf_counter() - t_start
+        return self
+
+    def map(self, numbers: list[int]) -> list[int]:
+        """
+        Process numbers in the pool
+        :param numbers: list of numbers
+        :return: list of numbers (0, 1)
+        """
+        self.start()
+        chunk_size = get_chunk_size(numbers, self.processes)
+        return self.pool.map(process_number, numbers, chunksize=chunk_size)
+
+    def close(self) -> None:
+        """
+        Stop worker processes
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self) -> "WorkerPool":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+_worker_pool = None
+
+
+def get_worker_pool() -> WorkerPool:
+    """
+    Shared persistent worker pool, started on first use and stopped at interpreter exit
+    :return: WorkerPool object
+    """
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = WorkerPool(start_method=START_METHOD).start()
+        atexit.register(_worker_pool.close)
+    return _worker_pool
+
+
+def run_worker_pool(numbers: list[int]) -> list[int]:
+    """
+    Run number processing in the shared persistent worker pool
+    :param numbers: list of numbers
+    :return: list of numbers (0, 1)
+    """
+    return get_worker_pool().map(numbers)
+
+
+def open_lookup_table(fp: str, size: int) -> np.memmap:
+    """
+    Memory-map the lookup table, growing it to hold at least size numbers
+    :param fp: filepath of the table
+    :param size: min amount of numbers in the table
+    :return: writable uint8 memmap
+    """
+    # Appending never shrinks the file, so concurrent growth by several processes is safe
+    with open(fp, "ab") as f:
+        current = f.tell()
+        if current < size:
+            f.write(bytes(size - current))
+
+    return np.memmap(fp, dtype=np.uint8, mode="r+")
+
+
+def lookup_results(values: np.ndarray, backend, fp: str) -> np.ndarray:
+    """
+    Get results for distinct numbers from the lookup table, computing and storing missing ones
+    :param values: array of distinct numbers greater than 1
+    :param backend: strategy function processing a list of numbers
+    :param fp: filepath of the lookup table
+    :return: array of numbers (0, 1)
+    """
+    table = open_lookup_table(fp, int(values.max()) + 1)
+    codes = table[values]
+    missing = values[codes == 0]
+    if missing.size:
+        # Results are deterministic, so processes racing to fill the same numbers write the same bytes
+        table[missing] = np.asarray(backend(missing.tolist()), dtype=np.uint8) + 1
+        table.flush()
+        codes = table[values]
+
+    return codes - 1
+
+
+def run_dedup(numbers: list[int], backend=run_single_thread, table_path: str = None) -> list[int]:
+    """
+    Process each distinct number once and broadcast results back to input order
+    :param numbers: list of numbers
+    :param backend: strategy function processing a list of numbers, e.g. run_mp_pool
+    :param table_path: filepath of a persistent lookup table, e.g. LOOKUP_TABLE_PATH, or None to not use one
+    :return: list of numbers (0, 1)
+    """
+    array = np.asarray(numbers, dtype=np.int64)
+    if not array.size:
+        return []
+
+    values, inverse = np.unique(array, return_inverse=True)
+    value_results = np.zeros(values.shape, dtype=np.uint8)
+    # Numbers below 2 are never prime, and can't index the table
+    candidates = values > 1
+    if candidates.any():
+        if table_path is None:
+            value_results[candidates] = backend(values[candidates].tolist())
+        else:
+            value_results[candidates] = lookup_results(values[candidates], backend, table_path)
+
+    return value_results[inverse].tolist()
+
+
+def run_dedup_table(numbers: list[int]) -> list[int]:
+    """
+    Process distinct numbers with the persistent lookup table
+    :param numbers: list of numbers
+    :return: list of numbers (0, 1)
+    """
+    return run_dedup(numbers, table_path=LOOKUP_TABLE_PATH)
+
+
+def generate_chunks(n: int, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[list[int]]:
+    """
+    Generate n random integers between 1 and 1000 lazily, chunk by chunk
+    :param n: how many numbers to generate
+    :param chunk_size: amount of numbers in a chunk
+    :return: iterator over lists of numbers
+    """
+    rng = np.random.default_rng()
+    for start in range(0, n, chunk_size):
+        yield rng.integers(1, 1001, size=min(chunk_size, n - start)).tolist()
+
+
+def stream_results(chunks, backend=None, max_in_flight: int = None) -> Iterator[tuple[list, list]]:
+    """
+    Process chunks as they are generated, holding at most max_in_flight chunks in memory
+    :param chunks: iterable of lists of numbers
+    :param backend: strategy function processing a list of numbers in this process,
+        or None to spread chunks over the persistent worker pool
+    :param max_in_flight: max amount of chunks submitted to the pool and not yet consumed, 2 per worker if None
+    :return: iterator over (chunk, results) pairs in input order
+    """
+    if backend is not None:
+        for chunk in chunks:
+            yield chunk, backend(chunk)
+        return
+
+    pool = get_worker_pool()
+    max_in_flight = max_in_flight or 2 * pool.processes
+    in_flight = collections.deque()
+    for chunk in chunks:
+        if len(in_flight) >= max_in_flight:
+            done_chunk, pending = in_flight.popleft()
+            yield done_chunk, pending.get()
+        in_flight.append((chunk, pool.pool.apply_async(process_batch, (chunk,))))
+
+    while in_flight:
+        done_chunk, pending = in_flight.popleft()
+        yield done_chunk, pending.get()
+
+
+def run_streaming(
+        count: int,
+        fp: str,
+        backend=None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        max_in_flight: int = None,
+) -> dict:
+    """
+    Generate, process and write count numbers with memory bounded by chunk size instead of count
+    :param count: amount of numbers to process
+    :param fp: output filepath, .npy for binary records with STREAM_DTYPE layout, CSV otherwise
+    :param backend: strategy function processing a list of numbers, None for the persistent worker pool
+    :param chunk_size: amount of numbers in a chunk
+    :param max_in_flight: max amount of chunks being processed at once
+    :return: dict with amount of processed numbers, amount of primes and execution time
+    """
+    t_start = time.perf_counter()
+    chunks = generate_chunks(count, chunk_size)
+    processed = 0
+    primes = 0
+
+    if fp.endswith(".npy"):
+        with open(fp, "wb") as f:
+            # Amount of records is known upfront, so .npy header goes first and records are appended chunk by chunk
+            header = {"descr": np.lib.format.dtype_to_descr(STREAM_DTYPE), "fortran_order": False, "shape": (count,)}
+            np.lib.format.write_array_header_1_0(f, header)
+            for chunk, results in stream_results(chunks, backend, max_in_flight):
+                records = np.empty(len(chunk), dtype=STREAM_DTYPE)
+                records["number"] = chunk
+                records["result"] = results
+                f.write(records.tobytes())
+                processed += len(chunk)
+                primes += sum(results)
+    else:
+        with open(fp, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["number", "result"])
+            for chunk, results in stream_results(chunks, backend, max_in_flight):
+                writer.writerows(zip(chunk, results))
+                processed += len(chunk)
+                primes += sum(results)
+
+    return {"count": processed, "primes": primes, "time": time.perf_counter() - t_start}
+
+
 def write_results(results: list, fp: str) -> None:
     """
     Write results to a csv file
@@ -142,7 +748,16 @@ def write_results(results: list, fp: str) -> None:
     """
     with open(fp, "w", newline="") as csvfile:
         fieldnames = [
-            "number", "Single Thread", "ThreadPoolExecutor", "multiprocessing_Pool", "multiprocessing_Process_Queue"
+            "number",
+            "Single Thread",
+            "ThreadPoolExecutor",
+            "multiprocessing_Pool",
+            "multiprocessing_Process_Queue",
+            "numpy",
+            "persistent_WorkerPool",
+            "work_stealing",
+            "dedup",
+            "dedup_lookup_table",
         ]
         writer = csv.writer(csvfile)
         writer.writerow(fieldnames)
@@ -163,9 +778,24 @@ def test_perf(count: int) -> (list, list):
     perf_log = list()
 
     all_result = []
-    for func in [run_single_thread, run_tpe, run_mp_pool, run_mp_process]:
+    strategies = [
+        run_single_thread,
+        run_tpe,
+        run_mp_pool,
+        run_mp_process,
+        run_numpy,
+        run_worker_pool,
+        schedule_work_stealing,
+        run_dedup,
+        run_dedup_table,
+    ]
+    for func in strategies:
         print(f"Starting processing using {func.__name__}...")
         all_time, results = time_func(func, numbers_list)
+        if func is schedule_work_stealing:
+            # Timed directly instead of run_work_stealing to report load of every worker
+            results, stats = results
+            print_worker_stats(stats)
         perf_log.append(all_time)
         all_result.append(results)
         print(f"Success! Processed {len(results)} numbers using {func.__name__} in {all_time} seconds.", "\n--")
@@ -176,6 +806,13 @@ def test_perf(count: int) -> (list, list):
 
 
 if __name__ == "__main__":
+    # Persistent pool is started once, its startup cost is reported apart from compute times
+    worker_pool = get_worker_pool()
+    print(
+        f"Started persistent worker pool ({START_METHOD or 'default'} start method) "
+        f"in {worker_pool.startup_time} seconds."
+    )
+
     performance = []
     count_range = [10 ** i for i in range(1, 7)]
     for count in count_range:
@@ -187,10 +824,21 @@ if __name__ == "__main__":
     write_results(perf_data, "data/performance.csv")
 
     performance_t = list(zip(*performance))
-    names = ["Single Thread", "ThreadPoolExecutor", "multiprocessing_Pool", "multiprocessing_Process_Queue"]
+    names = [
+        "Single Thread",
+        "ThreadPoolExecutor",
+        "multiprocessing_Pool",
+        "multiprocessing_Process_Queue",
+        "numpy",
+        "persistent_WorkerPool",
+        "work_stealing",
+        "dedup",
+        "dedup_lookup_table",
+    ]
     x = count_range
     fig, ax = plt.subplots()
     for name, y in zip(names, performance_t):
         ax.plot(x, y, label=name)
     ax.legend()
-    plt.show()
+    # Saved instead of shown, so the script also runs headless; see benchmark.py for repeated measurements
+    fig.savefig("data/performance.png")
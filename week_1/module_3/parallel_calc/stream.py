@@ -0,0 +1,31 @@
+import argparse
+import resource
+import sys
+
+from main import run_numpy, run_single_thread, run_streaming
+
+BACKENDS = {
+    "pool": None,
+    "numpy": run_numpy,
+    "single": run_single_thread,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process numbers in streaming mode with flat memory usage")
+    parser.add_argument("count", type=int, help="amount of numbers to process")
+    parser.add_argument("output", help="output filepath, .npy for compact binary records, CSV otherwise")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="pool")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    options = parser.parse_args()
+
+    stats = run_streaming(
+        options.count, options.output, BACKENDS[options.backend], options.chunk_size, options.max_in_flight
+    )
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    print(
+        f"Processed {stats['count']} numbers ({stats['primes']} primes) in {stats['time']:.2f} seconds, "
+        f"peak RSS {peak_rss / 2 ** 20:.1f} MiB"
+    )